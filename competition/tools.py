@@ -1,10 +1,13 @@
+import os
 import random
 import datetime
+import tempfile
 import numpy as np
 
 import scipy.sparse as sp
 import pandas as pd
 
+from concurrent.futures import ProcessPoolExecutor
 from itertools import islice, cycle
 from more_itertools import pairwise
 from implicit.nearest_neighbours import TFIDFRecommender, BM25Recommender, CosineRecommender
@@ -60,7 +63,12 @@ class TimeRangeSplit():
               user_column='user_id',
               item_column='item_id',
               datetime_column='date',
-              fold_stats=False):
+              fold_stats=False,
+              incremental=False):
+        if incremental:
+            yield from self._split_incremental(df, user_column, item_column, datetime_column, fold_stats)
+            return
+
         df_datetime = df[datetime_column]
         if self.train_min_date is not None:
             train_min_mask = df_datetime >= self.train_min_date
@@ -121,6 +129,85 @@ class TimeRangeSplit():
 
             yield (train_idx, test_idx, fold_info)
 
+    def _split_incremental(self, df, user_column, item_column, datetime_column, fold_stats):
+        """
+        Yields the same folds as split, but sorts by datetime once and cuts folds with searchsorted.
+        Instead of comparing each test slice with the whole train, the time every user, item and
+        (user, item) pair is first seen in train is computed once, so a test row is cold or already
+        seen iff that time is not before the fold start
+        """
+        df_datetime = df[datetime_column]
+        datetimes = _to_naive_datetime64(df_datetime)
+        order = np.argsort(datetimes, kind='stable')
+        sorted_datetimes = datetimes[order]
+        sorted_datetimes = sorted_datetimes[:np.count_nonzero(~np.isnat(sorted_datetimes))]
+
+        train_start = 0
+        if self.train_min_date is not None:
+            train_start = np.searchsorted(sorted_datetimes, _to_naive_datetime64([self.train_min_date])[0])
+
+        users = _factorize(df[user_column])
+        items = _factorize(df[item_column])
+        pairs = _factorize(users.astype(np.int64) * (items.max() + 1) + items)
+        users, items, pairs = users[order], items[order], pairs[order]
+        first_seen_user = _first_seen(users, sorted_datetimes, train_start)
+        first_seen_item = _first_seen(items, sorted_datetimes, train_start)
+        first_seen_pair = _first_seen(pairs, sorted_datetimes, train_start)
+
+        date_range = self.date_range[(self.date_range >= df_datetime.min()) & 
+                                     (self.date_range <= df_datetime.max())]
+        bounds = np.searchsorted(sorted_datetimes, _to_naive_datetime64(date_range))
+
+        train_rows = np.zeros(len(df), dtype=bool)
+        train_end = train_start
+        for (start, end), (test_start, test_end), start_datetime in zip(
+                pairwise(date_range), pairwise(bounds), _to_naive_datetime64(date_range)):
+            fold_info = {
+                'Start date': start,
+                'End date': end
+            }
+            train_rows[order[train_end:max(train_end, test_start)]] = True
+            train_end = max(train_end, test_start)
+            train_idx = df.index[train_rows]
+            if fold_stats:
+                fold_info['Train'] = len(train_idx)
+
+            test_users = users[test_start:test_end]
+            test_items = items[test_start:test_end]
+            keep = np.ones(test_end - test_start, dtype=bool)
+
+            if self.filter_cold_users:
+                cold = ~(first_seen_user[test_users] < start_datetime)
+                keep &= ~cold
+                if fold_stats:
+                    fold_info['New users'] = len(np.unique(test_users[cold]))
+                    fold_info['New users interactions'] = np.count_nonzero(cold)
+
+            if self.filter_cold_items:
+                cold = keep & ~(first_seen_item[test_items] < start_datetime)
+                keep &= ~cold
+                if fold_stats:
+                    fold_info['New items'] = len(np.unique(test_items[cold]))
+                    fold_info['New items interactions'] = np.count_nonzero(cold)
+
+            if self.filter_already_seen:
+                test_pairs = pairs[test_start:test_end]
+                seen = keep & (first_seen_pair[test_pairs] < start_datetime)
+                keep &= ~seen
+                if fold_stats:
+                    fold_info['Known interactions'] = len(np.unique(test_pairs[seen]))
+
+            test_positions = order[test_start:test_end][keep]
+            if self.filter_cold_users or self.filter_cold_items:
+                test_idx = np.unique(df.index.values[test_positions])
+            else:
+                test_idx = df.index[np.sort(test_positions)]
+
+            if fold_stats:
+                fold_info['Test'] = len(test_idx)
+
+            yield (train_idx, test_idx, fold_info)
+
     def get_n_splits(self, df, datetime_column='date'):
         df_datetime = df[datetime_column]
         if self.train_min_date is not None:
@@ -133,6 +220,29 @@ class TimeRangeSplit():
     
     
     
+def _to_naive_datetime64(values):
+    values = pd.DatetimeIndex(values)
+    if values.tz is not None:
+        values = values.tz_convert(None)
+    return values.values
+
+
+def _factorize(values):
+    codes, uniques = pd.factorize(values)
+    codes[codes < 0] = len(uniques)
+    return codes
+
+
+def _first_seen(codes, sorted_datetimes, train_start):
+    """
+    Earliest datetime of every code among rows sorted by datetime starting from train_start, NaT if never seen
+    """
+    first_seen = np.full(codes.max(initial=-1) + 1, np.datetime64('NaT'), dtype=sorted_datetimes.dtype)
+    seen_codes, first_positions = np.unique(codes[train_start:len(sorted_datetimes)], return_index=True)
+    first_seen[seen_codes] = sorted_datetimes[train_start:][first_positions]
+    return first_seen
+
+
 def get_coo_matrix(df, 
                    user_col='user_id', 
                    item_col='item_id', 
@@ -155,6 +265,133 @@ def get_coo_matrix(df,
     return interaction_matrix
 
 
+def _mapping_encoder(mapping):
+    keys = pd.Index(list(mapping.keys()))
+    values = np.fromiter(mapping.values(), dtype=np.int64, count=len(mapping))
+
+    def _encode(column):
+        positions = keys.get_indexer(column)
+        return np.where(positions >= 0, values[positions], -1)
+    return _encode, (int(values.max()) + 1 if len(values) else 0)
+
+
+def _iter_interaction_chunks(data, columns, chunksize):
+    if isinstance(data, pd.DataFrame):
+        if chunksize is None:
+            yield data
+        else:
+            for start in range(0, len(data), chunksize):
+                yield data.iloc[start:start + chunksize]
+    elif isinstance(data, (str, os.PathLike)):
+        if str(data).endswith('.parquet'):
+            import pyarrow.parquet as pq
+            parquet_file = pq.ParquetFile(data)
+            if chunksize is None:
+                yield parquet_file.read(columns=columns).to_pandas()
+            else:
+                for batch in parquet_file.iter_batches(batch_size=chunksize, columns=columns):
+                    yield batch.to_pandas()
+        elif chunksize is None:
+            yield pd.read_csv(data, usecols=columns)
+        else:
+            yield from pd.read_csv(data, usecols=columns, chunksize=chunksize)
+    else:
+        yield from data
+
+
+def _reduce_duplicates(keys, weights, reduce):
+    """
+    Sorts keys and reduces weights of equal keys with a ufunc, e.g. np.add or np.maximum
+    """
+    order = np.argsort(keys, kind='stable')
+    keys, weights = keys[order], weights[order]
+    if len(keys):
+        starts = np.r_[0, np.flatnonzero(np.diff(keys)) + 1]
+        keys, weights = keys[starts], reduce.reduceat(weights, starts)
+    return keys, weights
+
+
+def build_interaction_matrix(data, 
+                             users_mapping, 
+                             items_mapping, 
+                             user_col='user_id', 
+                             item_col='item_id', 
+                             weight_col=None, 
+                             matrix_format='csr', 
+                             aggregate='sum', 
+                             unknown='drop', 
+                             chunksize=None, 
+                             return_stats=False):
+    """
+    Builds a users x items interaction matrix shaped by the mappings
+
+    data may be a DataFrame, a path to a csv or parquet file or an iterable of DataFrames;
+    with chunksize set, files are read and encoded chunk by chunk, so only the aggregated
+    matrix has to fit in memory. Ids are encoded with one hash lookup per column instead of
+    Series.map, rows with ids missing from the mappings are dropped (unknown='drop') or
+    raise KeyError (unknown='raise'). Duplicate (user, item) pairs are summed or, with
+    aggregate='max', reduced to the largest weight. Every chunk is reduced to unique
+    (user, item) keys, and pending chunks are merged into the result once they hold as many
+    keys as it does, so every key is re-merged O(log chunks) times rather than once per chunk.
+    With return_stats=True also returns counts of dropped rows and unknown users/items
+    """
+    if aggregate not in ('sum', 'max'):
+        raise ValueError(f'Unknown aggregate "{aggregate}", use "sum" or "max"')
+    encode_users, n_users = _mapping_encoder(users_mapping)
+    encode_items, n_items = _mapping_encoder(items_mapping)
+    shape = (n_users, n_items)
+    columns = [user_col, item_col] + ([weight_col] if weight_col is not None else [])
+
+    reduce = np.add if aggregate == 'sum' else np.maximum
+    n_cols = max(n_items, 1)
+    merged_keys, merged_weights = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    pending, n_pending = [], 0
+
+    def _merge():
+        return _reduce_duplicates(
+            np.concatenate([merged_keys] + [keys for keys, _ in pending]),
+            np.concatenate([merged_weights] + [weights for _, weights in pending]),
+            reduce,
+        )
+
+    stats = {'rows': 0, 'dropped_rows': 0, 'unknown_users': set(), 'unknown_items': set()}
+    for chunk in _iter_interaction_chunks(data, columns, chunksize):
+        rows = encode_users(chunk[user_col])
+        cols = encode_items(chunk[item_col])
+        known = (rows >= 0) & (cols >= 0)
+        if not known.all():
+            if unknown == 'raise':
+                column = user_col if (rows < 0).any() else item_col
+                values = chunk[column].to_numpy()[(rows if column == user_col else cols) < 0]
+                raise KeyError(f'{column} {values[0]} is not in the mapping')
+            stats['unknown_users'].update(chunk[user_col].to_numpy()[rows < 0].tolist())
+            stats['unknown_items'].update(chunk[item_col].to_numpy()[cols < 0].tolist())
+        stats['rows'] += len(chunk)
+        stats['dropped_rows'] += int((~known).sum())
+
+        if weight_col is None:
+            weights = np.ones(int(known.sum()), dtype=np.float32)
+        else:
+            weights = chunk[weight_col].to_numpy(dtype=np.float32)[known]
+        keys = rows[known].astype(np.int64) * n_cols + cols[known]
+        pending.append(_reduce_duplicates(keys, weights, reduce))
+        n_pending += len(pending[-1][0])
+        if n_pending >= len(merged_keys):
+            merged_keys, merged_weights = _merge()
+            pending, n_pending = [], 0
+    if pending:
+        merged_keys, merged_weights = _merge()
+
+    matrix = sp.csr_matrix(
+        (merged_weights, (merged_keys // n_cols, merged_keys % n_cols)), shape=shape, dtype=np.float32
+    ).asformat(matrix_format)
+    if return_stats:
+        stats['unknown_users'] = len(stats['unknown_users'])
+        stats['unknown_items'] = len(stats['unknown_items'])
+        return matrix, stats
+    return matrix
+
+
 def generate_implicit_recs_mapper(
     model,
     train_matrix,
@@ -180,6 +417,82 @@ def generate_recs(model, mapper, list_user_id):
     recs['rank'] = recs.groupby('user_id').cumcount() + 1
     return recs
 
+def _mapping_to_arrays(mapping):
+    if isinstance(mapping, pd.Series):
+        return mapping.index, mapping.to_numpy(dtype=np.int64)
+    return pd.Index(list(mapping.keys())), np.fromiter(mapping.values(), dtype=np.int64, count=len(mapping))
+
+
+def _score_users(model, train_matrix, user_ids):
+    if hasattr(model, 'user_factors') and hasattr(model, 'item_factors'):
+        return np.asarray(model.user_factors[user_ids] @ model.item_factors.T, dtype=np.float32)
+    if hasattr(model, 'similarity'):
+        scores = (train_matrix[user_ids] @ model.similarity).toarray().astype(np.float32)
+        # items without a stored similarity are not returned by the per-user recommend
+        scores[scores == 0] = -np.inf
+        return scores
+    raise TypeError(f'{type(model).__name__} has neither factors nor an item similarity matrix')
+
+
+def iter_implicit_recs_batched(
+    model,
+    train_matrix,
+    list_user_id,
+    top_N,
+    user_mapping,
+    item_inv_mapping,
+    filter_already_liked_items=True,
+    chunk_size=10000
+):
+    """
+    Yields (user_id, item_id, rank) frames for chunks of chunk_size users:
+    every chunk is scored with one matrix product against item factors
+    (or the item similarity matrix for nearest neighbour models), already liked items
+    are masked straight from the CSR train matrix and top_N is selected with argpartition.
+    Mappings are dicts or pd.Series
+    """
+    train_matrix = train_matrix.tocsr()
+    user_keys, user_values = _mapping_to_arrays(user_mapping)
+    item_ids = pd.Series(item_inv_mapping).reindex(np.arange(train_matrix.shape[1])).to_numpy()
+
+    list_user_id = np.asarray(list_user_id)
+    positions = user_keys.get_indexer(list_user_id)
+    if (positions < 0).any():
+        raise KeyError(list_user_id[positions < 0][0])
+    internal_user_ids = user_values[positions]
+
+    for start in range(0, len(list_user_id), chunk_size):
+        block = internal_user_ids[start:start + chunk_size]
+        scores = _score_users(model, train_matrix, block)
+        if filter_already_liked_items:
+            liked = train_matrix[block]
+            scores[np.repeat(np.arange(len(block)), np.diff(liked.indptr)), liked.indices] = -np.inf
+
+        n = min(top_N, scores.shape[1])
+        top = np.argpartition(-scores, n - 1, axis=1)[:, :n]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind='stable')
+        top = np.take_along_axis(top, order, axis=1)
+        valid = np.isfinite(np.take_along_axis(top_scores, order, axis=1))
+
+        rows, cols = np.nonzero(valid)
+        yield pd.DataFrame({
+            'user_id': list_user_id[start:start + chunk_size][rows],
+            'item_id': item_ids[top[rows, cols]],
+            'rank': cols + 1,
+        })
+
+
+def generate_recs_batched(*args, **kwargs):
+    """
+    Same frame as generate_recs(model, generate_implicit_recs_mapper(...), list_user_id)
+    built with iter_implicit_recs_batched, takes the same arguments
+    """
+    chunks = list(iter_implicit_recs_batched(*args, **kwargs))
+    if not chunks:
+        return pd.DataFrame({'user_id': [], 'item_id': [], 'rank': []})
+    return pd.concat(chunks, ignore_index=True)
+
 def compute_metrics(train, test, recs, top_N):
     result = {}
     test_recs = test.set_index(['user_id', 'item_id']).join(recs.set_index(['user_id', 'item_id']))
@@ -196,6 +509,44 @@ def compute_metrics(train, test, recs, top_N):
     
     return pd.Series(result)
 
+def _encode_pairs(df_true, df_pred):
+    user_codes, _ = pd.factorize(pd.concat([df_true['user_id'], df_pred['user_id']], ignore_index=True))
+    item_codes, item_uniques = pd.factorize(pd.concat([df_true['item_id'], df_pred['item_id']], ignore_index=True))
+    pair_keys = user_codes.astype(np.int64) * max(len(item_uniques), 1) + item_codes
+    n_true = len(df_true)
+    return user_codes[:n_true], pair_keys[:n_true], pair_keys[n_true:]
+
+
+def compute_metrics_fast(train, test, recs, top_N):
+    """
+    Same MAP as compute_metrics without the MultiIndex join and groupby passes:
+    ids are encoded to integer codes once and ranks of test items are found with searchsorted.
+    (user_id, item_id) pairs in recs are expected to be unique
+    """
+    true_users, true_keys, pred_keys = _encode_pairs(test, recs)
+    order = np.argsort(pred_keys, kind='stable')
+    sorted_keys = pred_keys[order]
+    ranks = np.full(len(true_keys), np.nan)
+    if len(sorted_keys) > 0:
+        positions = np.minimum(np.searchsorted(sorted_keys, true_keys), len(sorted_keys) - 1)
+        found = sorted_keys[positions] == true_keys
+        ranks[found] = recs['rank'].to_numpy(dtype=np.float64)[order][positions[found]]
+
+    _, users, users_item_count = np.unique(true_users, return_inverse=True, return_counts=True)
+    hit = ~np.isnan(ranks)
+    hit_users, hit_ranks = users[hit], ranks[hit]
+    order = np.lexsort((hit_ranks, hit_users))
+    hit_users, hit_ranks = hit_users[order], hit_ranks[order]
+    group_starts = np.r_[0, np.flatnonzero(np.diff(hit_users)) + 1]
+    group_sizes = np.diff(np.r_[group_starts, len(hit_users)])
+    cumulative_rank = np.arange(len(hit_users)) - np.repeat(group_starts, group_sizes) + 1
+
+    users_count = len(users_item_count)
+    result = {
+        f'MAP@{top_N}': (cumulative_rank / hit_ranks / users_item_count[hit_users]).sum() / users_count
+    }
+    return pd.Series(result)
+
 def get_ranks_sum(recs_with_ranks, intersection):
     cumulative_ranks_total = 0
     
@@ -222,4 +573,171 @@ def compute_metric_leaderboard(test, recs):
         lambda x: get_ranks_sum(x['recs_with_ranks'], x['intersection']), axis=1)
     test_recs_g['cumulative_ranks_total'] = test_recs_g['cumulative_ranks_total'] / test_recs_g['users_item_count']
     users_count = test_recs_g.user_id.nunique()
-    return test_recs_g['cumulative_ranks_total'].sum()/users_count
\ No newline at end of file
+    return test_recs_g['cumulative_ranks_total'].sum()/users_count
+
+def parse_list_column(column):
+    """
+    Parses a column of stringified lists like "[1, 2, 3]" in bulk
+
+    Returns a flat int64 array of all values and offsets such that
+    values of row i are flat[offsets[i]:offsets[i + 1]]
+    """
+    stripped = column.fillna('').astype(str).str.strip('[] ')
+    lengths = np.where(stripped.str.len() > 0, stripped.str.count(',') + 1, 0)
+    flat = np.fromstring(','.join(stripped[lengths > 0]), dtype=np.int64, sep=',')
+    if len(flat) != lengths.sum():
+        raise ValueError('List column contains values that are not integers')
+    offsets = np.r_[0, np.cumsum(lengths)].astype(np.int64)
+    return flat, offsets
+
+
+class LeaderboardScorer():
+    """
+    Exact MAP of compute_metric_leaderboard without the substring matching:
+    ground truth is parsed once into sorted (user, item) keys and submissions are scored
+    by vectorized set membership, in one piece or streamed from csv in chunks
+    """
+    def __init__(self, test, user_column='user_id', item_column='item_id'):
+        test = test.reset_index()
+        self.user_column = user_column
+        self.item_column = item_column
+        self.users = pd.Index(test[user_column].unique())
+        users = self.users.get_indexer(test[user_column])
+        items, offsets = parse_list_column(test[item_column])
+        lengths = np.diff(offsets)
+        self.users_item_count = np.bincount(users, weights=lengths, minlength=len(self.users))
+        self.item_ids = pd.Index(np.unique(items))
+        self.test_keys = np.unique(
+            np.repeat(users, lengths).astype(np.int64) * len(self.item_ids) + self.item_ids.get_indexer(items))
+
+    def _precision_sum(self, recs):
+        recs = recs.reset_index()
+        users = self.users.get_indexer(recs[self.user_column])
+        items, offsets = parse_list_column(recs[self.item_column])
+        lengths = np.diff(offsets)
+        rows = np.repeat(np.arange(len(recs)), lengths)
+        ranks = np.arange(len(items)) - offsets[rows] + 1
+        item_codes = self.item_ids.get_indexer(items)
+        hit_users = users[rows]
+        known = (hit_users >= 0) & (item_codes >= 0)
+        keys = hit_users[known].astype(np.int64) * len(self.item_ids) + item_codes[known]
+        hit = np.zeros(len(items), dtype=bool)
+        hit[np.flatnonzero(known)[np.isin(keys, self.test_keys)]] = True
+
+        cumulative_hits = np.cumsum(hit)
+        row_hits_before = np.r_[0, cumulative_hits][offsets[:-1]]
+        cumulative_rank = cumulative_hits[hit] - row_hits_before[rows[hit]]
+        return (cumulative_rank / ranks[hit] / self.users_item_count[hit_users[hit]]).sum()
+
+    def score(self, recs):
+        return self._precision_sum(recs) / len(self.users)
+
+    def score_csv(self, path, chunksize=100000, **read_csv_kwargs):
+        total = 0.
+        for chunk in pd.read_csv(path, chunksize=chunksize, **read_csv_kwargs):
+            total += self._precision_sum(chunk)
+        return total / len(self.users)
+
+
+def compute_metric_leaderboard_fast(test, recs):
+    return LeaderboardScorer(test).score(recs)
+
+
+def _evaluate_fold(task):
+    shared_dir, fold_number, model_name, model_class, model_params, top_N, filter_already_liked_items = task
+
+    def _load(name):
+        return np.load(os.path.join(shared_dir, f'{name}.npy'), mmap_mode='r')
+
+    users, items = _load('users'), _load('items')
+    train_start, train_end = _load('train_cuts')[fold_number]
+    if train_start >= 0:
+        train_pos = np.asarray(_load('order')[train_start:train_end])
+    else:
+        train_pos = np.asarray(_load(f'train_{fold_number}'))
+    test_pos = _load(f'test_{fold_number}')
+    weights = _load('weights')[train_pos] if os.path.exists(os.path.join(shared_dir, 'weights.npy')) \
+        else np.ones(len(train_pos), dtype=np.float32)
+
+    n_users, n_items = int(users.max()) + 1, int(items.max()) + 1
+    train_mat = sp.coo_matrix((weights, (users[train_pos], items[train_pos])), shape=(n_users, n_items)).tocsr()
+    model = model_class(**model_params)
+    model.fit(train_mat.T, show_progress=False)
+
+    test = pd.DataFrame({'user_id': users[test_pos], 'item_id': items[test_pos]})
+    recs = generate_recs_batched(
+        model, train_mat, test['user_id'].unique(), top_N,
+        pd.Series(np.arange(n_users)), pd.Series(np.arange(n_items)), filter_already_liked_items)
+
+    fold_result = compute_metrics_fast(None, test, recs, top_N)
+    return {'Model': model_name, 'Fold': fold_number, **fold_result.to_dict()}
+
+
+def run_cv_parallel(df, 
+                    folds, 
+                    models, 
+                    top_N=10, 
+                    user_column='user_id', 
+                    item_column='item_id', 
+                    weight_column=None, 
+                    datetime_column=None, 
+                    filter_already_liked_items=True, 
+                    n_jobs=None, 
+                    tmp_dir=None):
+    """
+    Evaluates every model on every fold of TimeRangeSplit.split in a process pool
+
+    Interaction columns are encoded to integer codes once and written to memory-mapped .npy files
+    together with fold positions, so workers attach to them instead of receiving a pickled DataFrame.
+    folds are consumed lazily and every fold is written as soon as it is produced, so only one
+    fold is held in memory. If datetime_column is given, rows are sorted by it once and a fold
+    whose train is a datetime range (as in TimeRangeSplit) is stored as two offsets into that order,
+    only test positions are saved per fold.
+    models maps a name to (model_class, params), e.g. {'tfidf_10': (TFIDFRecommender, {'K': 10})},
+    which makes hyperparameter sweeps one entry per parameter set. Models should be created with
+    num_threads=1 or so, since folds already run in n_jobs processes.
+    Returns one metrics table with a row per (model, fold) and fold_info columns
+    """
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as shared_dir:
+        def _save(name, values):
+            np.save(os.path.join(shared_dir, f'{name}.npy'), values, allow_pickle=False)
+
+        _save('users', _factorize(df[user_column]))
+        _save('items', _factorize(df[item_column]))
+        if weight_column is not None:
+            _save('weights', df[weight_column].to_numpy(dtype=np.float32))
+
+        ranks = None
+        if datetime_column is not None:
+            order = np.argsort(_to_naive_datetime64(df[datetime_column]), kind='stable')
+            ranks = np.empty(len(order), dtype=np.int64)
+            ranks[order] = np.arange(len(order))
+            _save('order', order)
+
+        fold_infos, train_cuts = [], []
+        for fold_number, (train_idx, test_idx, fold_info) in enumerate(folds):
+            train_pos = df.index.get_indexer(train_idx)
+            train_ranks = None if ranks is None else ranks[train_pos]
+            if train_ranks is not None and len(train_ranks) > 0 \
+                    and train_ranks.max() - train_ranks.min() + 1 == len(train_ranks):
+                # train is a datetime range, which is a slice of the sort order: only its bounds are saved
+                train_cuts.append((train_ranks.min(), train_ranks.max() + 1))
+            else:
+                train_cuts.append((-1, -1))
+                _save(f'train_{fold_number}', train_pos)
+            _save(f'test_{fold_number}', df.index.get_indexer(test_idx))
+            fold_infos.append(fold_info)
+        n_folds = len(fold_infos)
+        _save('train_cuts', np.asarray(train_cuts, dtype=np.int64).reshape(n_folds, 2))
+
+        tasks = [
+            (shared_dir, fold_number, model_name, model_class, model_params, top_N, filter_already_liked_items)
+            for model_name, (model_class, model_params) in models.items()
+            for fold_number in range(n_folds)
+        ]
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            results = list(executor.map(_evaluate_fold, tasks))
+
+    results = pd.DataFrame(results)
+    fold_infos = pd.DataFrame(fold_infos).rename_axis('Fold').reset_index()
+    return results.merge(fold_infos, on='Fold', how='left')
@@ -0,0 +1,235 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import pickle
+from pathlib import Path
+from typing import Any, Dict, Optional, Union
+
+import numpy as np
+from annoy import AnnoyIndex # type: ignore
+
+from ann.mappings import IdMapping
+
+PathLike = Union[str, Path]
+
+SOURCE_KEYS = ("user_vectors_path", "item_vectors_path", "user_map_path", "item_map_path")
+# artifacts the service uses if they exist
+OPTIONAL_SOURCE_KEYS = ("neighbors_path", "user_recs_path")
+
+
+def load_object(path: PathLike) -> Any:
+    with open(path, "rb") as fh:
+        obj = pickle.load(fh)
+    return obj
+
+
+def load_vectors(path: PathLike) -> Any:
+    """
+    Loads vectors from .npy with memory mapping or from a pickle otherwise
+    """
+    if Path(path).suffix == ".npy":
+        return np.load(path, mmap_mode="r", allow_pickle=False)
+    return load_object(path)
+
+
+def load_mapping(path: PathLike) -> Any:
+    """
+    Loads an IdMapping from .npy with memory mapping or a pickled dict otherwise
+    """
+    if Path(path).suffix == ".npy":
+        return IdMapping.load(path)
+    return load_object(path)
+
+
+def read_vectors_and_mappings(
+    user_vectors_path: PathLike,
+    item_vectors_path: PathLike,
+    user_map_path: PathLike,
+    item_map_path: PathLike,
+    **kwargs: Any,
+):
+    return (
+        load_vectors(user_vectors_path),
+        load_vectors(item_vectors_path),
+        load_mapping(user_map_path),
+        load_mapping(item_map_path),
+    )
+
+
+def convert_to_npy(
+    user_vectors_path: PathLike,
+    item_vectors_path: PathLike,
+    user_map_path: PathLike,
+    item_map_path: PathLike,
+    output_dir: Optional[PathLike] = None,
+    **kwargs: Any,
+) -> Dict[str, Path]:
+    """
+    Converts pickled vectors and mappings to .npy files, artifacts that already are .npy are kept as is
+
+    Parameters
+    ----------
+    output_dir
+        Directory to write .npy files to, next to the pickles if None
+
+    Returns
+    -------
+    Paths of converted artifacts under the same keys as the arguments
+    """
+    def _target(path: PathLike) -> Path:
+        target = Path(path).with_suffix(".npy")
+        return target if output_dir is None else Path(output_dir) / target.name
+
+    converted = {}
+    for key, path in (("user_vectors_path", user_vectors_path), ("item_vectors_path", item_vectors_path)):
+        converted[key] = Path(path)
+        if converted[key].suffix != ".npy":
+            converted[key] = _target(path)
+            np.save(converted[key], np.ascontiguousarray(load_vectors(path), dtype=np.float32), allow_pickle=False)
+    for key, path in (("user_map_path", user_map_path), ("item_map_path", item_map_path)):
+        converted[key] = Path(path)
+        if converted[key].suffix != ".npy":
+            converted[key] = _target(path)
+            IdMapping.from_dict(load_mapping(path)).save(converted[key])
+    return converted
+
+
+def file_hash(path: PathLike, chunk_size: int = 1 << 20) -> str:
+    """
+    Computes sha256 of a file content without reading it into memory at once
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def vectors_hash(vectors: Any, n_rows: Optional[int] = None, block_size: int = 65536) -> str:
+    """
+    Computes sha256 of the first n_rows vectors (all if None) without copying them at once
+    """
+    n_rows = len(vectors) if n_rows is None else n_rows
+    digest = hashlib.sha256()
+    for start in range(0, n_rows, block_size):
+        digest.update(np.ascontiguousarray(vectors[start:min(start + block_size, n_rows)], dtype=np.float32).tobytes())
+    return digest.hexdigest()
+
+
+def _file_stamp(path: PathLike) -> str:
+    stat = Path(path).stat()
+    return f"{Path(path).resolve()}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def sources_fingerprint(*paths: PathLike, config: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Cheap identifier of source files that changes whenever any of them is rewritten, their content is not read.
+    Json serializable config the artifact was built with is mixed in, if it is given
+    """
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(_file_stamp(path).encode())
+    if config is not None:
+        digest.update(json.dumps(config, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def save_npy_atomic(path: PathLike, array: np.ndarray) -> None:
+    """
+    Saves an array to .npy through a temporary file, so that readers never see a half written file
+    """
+    path = Path(path)
+    tmp_path = path.with_name(f"{path.stem}.tmp{os.getpid()}.npy")
+    np.save(tmp_path, array, allow_pickle=False)
+    os.replace(tmp_path, path)
+
+
+def save_json_atomic(path: PathLike, obj: Any) -> None:
+    path = Path(path)
+    tmp_path = path.with_name(f"{path.name}.tmp{os.getpid()}")
+    with open(tmp_path, "w") as fh:
+        json.dump(obj, fh)
+    os.replace(tmp_path, path)
+
+
+def index_signature(item_vectors_path: PathLike, dim: int, metric: str, n_trees: int) -> Dict[str, Any]:
+    """
+    Describes everything a persisted Annoy index depends on
+
+    Parameters
+    ----------
+    item_vectors_path
+        Path to the item vectors the index was built from
+    dim
+        Dimensionality of item embeddings
+    metric
+        Annoy metric
+    n_trees
+        Number of trees in annoy index
+
+    Returns
+    -------
+    A json serializable signature to store next to the index
+    """
+    return {
+        "item_vectors_sha256": file_hash(item_vectors_path),
+        "dim": dim,
+        "metric": metric,
+        "n_trees": n_trees,
+    }
+
+
+def model_version(paths: Dict[str, Any], recommender_conf: Dict[str, Any]) -> str:
+    """
+    Short identifier of the model artifacts and the recommender config, changes whenever
+    any of the vectors, mappings, neighbors or user recommendations files is rewritten or the config changes
+    """
+    digest = hashlib.sha256(json.dumps(recommender_conf, sort_keys=True).encode())
+    optional_keys = tuple(key for key in OPTIONAL_SOURCE_KEYS if paths.get(key) and Path(paths[key]).exists())
+    for key in SOURCE_KEYS + optional_keys:
+        digest.update(_file_stamp(paths[key]).encode())
+    return digest.hexdigest()[:12]
+
+
+def _meta_path(index_path: PathLike) -> Path:
+    return Path(f"{index_path}.json")
+
+
+def save_index(index: AnnoyIndex, index_path: PathLike, signature: Dict[str, Any]) -> None:
+    """
+    Saves an Annoy index and its signature, both files are replaced atomically
+    so that concurrently starting workers never load a half written index
+    """
+    index_path = Path(index_path)
+    tmp_suffix = f".tmp{os.getpid()}"
+    tmp_index_path = index_path.with_name(index_path.name + tmp_suffix)
+    tmp_meta_path = _meta_path(index_path).with_name(_meta_path(index_path).name + tmp_suffix)
+    index.save(str(tmp_index_path))
+    with open(tmp_meta_path, "w") as fh:
+        json.dump(signature, fh)
+    os.replace(tmp_index_path, index_path)
+    os.replace(tmp_meta_path, _meta_path(index_path))
+
+
+def load_index(
+    index_path: PathLike, dim: int, metric: str, signature: Dict[str, Any]
+) -> Optional[AnnoyIndex]:
+    """
+    Memory-maps a persisted Annoy index if its signature matches the expected one
+
+    Returns
+    -------
+    Loaded index or None if there is no index or it is stale
+    """
+    meta_path = _meta_path(index_path)
+    if not Path(index_path).exists() or not meta_path.exists():
+        return None
+    with open(meta_path, "r") as fh:
+        stored_signature = json.load(fh)
+    if stored_signature != signature:
+        return None
+    index = AnnoyIndex(dim, metric)
+    index.load(str(index_path), prefault=False)
+    return index
@@ -0,0 +1,168 @@
+from __future__ import annotations
+
+import asyncio
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, FrozenSet, Hashable, List, Optional, Sequence, Set, Tuple
+
+BatchFunction = Callable[
+    [Sequence[Hashable], Sequence[Hashable], bool],
+    Tuple[Dict[Hashable, Sequence[Hashable]], Dict[Hashable, str]],
+]
+
+
+class _Pending:
+    __slots__ = ("user_id", "item_whitelist", "bruteforce", "future")
+
+    def __init__(
+        self, user_id: Hashable, item_whitelist: Sequence[Hashable], bruteforce: bool, future: asyncio.Future
+    ) -> None:
+        self.user_id = user_id
+        self.item_whitelist = item_whitelist
+        self.bruteforce = bruteforce
+        self.future = future
+
+
+class MicroBatcher:
+    """
+    Queues single-user requests and scores them in batches on a thread pool outside the event loop
+
+    Requests that arrive within max_wait_ms of the first one, up to max_batch_size of them,
+    are coalesced. Requests with the same whitelist and mode are scored by one recommend_batch call.
+    While all n_workers threads are busy new requests keep accumulating, so batches grow under load.
+
+    Attributes
+    ----------
+    recommend_batch
+        A callable with the signature of AnnoyRecommender.recommend_batch
+    max_batch_size
+        Maximum number of requests coalesced into one batch
+    max_wait_ms
+        Maximum time the first request of a batch waits for others
+    n_workers
+        Number of threads that run batches concurrently
+    """
+    def __init__(
+        self,
+        recommend_batch: BatchFunction,
+        max_batch_size: int = 64,
+        max_wait_ms: float = 2.0,
+        n_workers: int = 4,
+    ) -> None:
+        self.recommend_batch = recommend_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.n_workers = n_workers
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        # calls submitted by run(), stop() waits for them before shutting the thread pool down
+        self._runs: Set[asyncio.Future] = set()
+        self.executor = ThreadPoolExecutor(max_workers=n_workers, thread_name_prefix="recommender")
+
+    def start(self) -> None:
+        self._queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self.n_workers)
+        self._task = asyncio.get_running_loop().create_task(self._collect())
+
+    async def stop(self) -> None:
+        """
+        Waits until all queued requests are scored and all calls submitted by run() return,
+        then stops the batcher
+        """
+        if self._queue is not None:
+            await self._queue.join()
+        if self._runs:
+            await asyncio.wait(list(self._runs))
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.executor.shutdown(wait=False)
+
+    async def submit(
+        self, user_id: Hashable, item_whitelist: Sequence[Hashable], bruteforce: bool = False
+    ) -> Sequence[Hashable]:
+        """
+        Enqueues a single-user request and waits for its batch to be scored
+
+        Raises
+        ------
+        KeyError
+            If the user or any of the whitelisted items is unknown
+        """
+        if self._queue is None:
+            raise RuntimeError("MicroBatcher is not started")
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(_Pending(user_id, item_whitelist, bruteforce, future))
+        return await future
+
+    async def run(self, func: Callable[..., Any], *args: Any) -> Any:
+        """
+        Runs a blocking callable on the batcher's thread pool
+        """
+        future = asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+        self._runs.add(future)
+        future.add_done_callback(self._runs.discard)
+        return await future
+
+    async def _collect(self) -> None:
+        loop = asyncio.get_running_loop()
+        assert self._queue is not None and self._slots is not None
+        while True:
+            await self._slots.acquire()
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait_ms / 1000
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            task = loop.run_in_executor(self.executor, self._score, batch)
+            task.add_done_callback(lambda _, size=len(batch): self._release(size))
+
+    def _release(self, batch_size: int) -> None:
+        assert self._queue is not None and self._slots is not None
+        self._slots.release()
+        for _ in range(batch_size):
+            self._queue.task_done()
+
+    def _score(self, batch: List[_Pending]) -> None:
+        groups: Dict[Tuple[FrozenSet[Hashable], bool], List[_Pending]] = defaultdict(list)
+        for pending in batch:
+            groups[(frozenset(pending.item_whitelist), pending.bruteforce)].append(pending)
+
+        for (_, bruteforce), group in groups.items():
+            user_ids = list(dict.fromkeys(pending.user_id for pending in group))
+            try:
+                recommendations, errors = self.recommend_batch(user_ids, group[0].item_whitelist, bruteforce)
+            except Exception as exc:  # pylint: disable=broad-except
+                for pending in group:
+                    _resolve(pending.future, exception=exc)
+                continue
+            for pending in group:
+                if pending.user_id in recommendations:
+                    _resolve(pending.future, result=recommendations[pending.user_id])
+                else:
+                    _resolve(pending.future, exception=KeyError(errors.get(pending.user_id, pending.user_id)))
+
+
+def _resolve(future: asyncio.Future, result: Any = None, exception: Optional[BaseException] = None) -> None:
+    """
+    Sets a future's outcome from a worker thread through its event loop
+    """
+    def _set() -> None:
+        if future.done():
+            return
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+
+    future.get_loop().call_soon_threadsafe(_set)
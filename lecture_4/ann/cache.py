@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Sequence, Tuple
+
+import numpy as np
+
+CacheKey = Tuple[Hashable, str, bool, Optional[str]]
+
+
+def whitelist_digest(item_whitelist: Sequence[Hashable]) -> str:
+    """
+    Hashes a whitelist regardless of the order and duplicates of its items
+    """
+    if len(item_whitelist) == 0:
+        return ""
+    items = np.unique(np.asarray(item_whitelist))
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(items.dtype.str.encode())
+    digest.update(items.tobytes() if items.dtype != object else repr(items.tolist()).encode())
+    return digest.hexdigest()
+
+
+class RecommendationCache:
+    """
+    Thread-safe LRU cache of recommendations with a time to live
+
+    Entries are keyed on (user_id, whitelist digest, bruteforce, model version), so responses
+    of a previous model are never served after the model changes; invalidate() drops them eagerly.
+
+    Attributes
+    ----------
+    max_entries
+        Maximum number of cached responses, the least recently used one is evicted beyond it
+    ttl_seconds
+        Time after which an entry expires, entries never expire if None
+    """
+    def __init__(self, max_entries: int = 100000, ttl_seconds: Optional[float] = 300.0) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[CacheKey, Tuple[float, Tuple[Hashable, ...]]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def key(
+        user_id: Hashable, item_whitelist: Sequence[Hashable], bruteforce: bool, model_version: Optional[str]
+    ) -> CacheKey:
+        return (user_id, whitelist_digest(item_whitelist), bruteforce, model_version)
+
+    def get(self, key: CacheKey) -> Optional[Tuple[Hashable, ...]]:
+        """
+        Returns cached recommendations or None on a miss
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: CacheKey, recommendations: Sequence[Hashable]) -> None:
+        expires_at = float("inf") if self.ttl_seconds is None else time.monotonic() + self.ttl_seconds
+        with self._lock:
+            self._entries[key] = (expires_at, tuple(recommendations))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, model_version: Optional[str] = None) -> None:
+        """
+        Drops entries of all model versions but model_version, or all entries if it is None
+        """
+        with self._lock:
+            if model_version is None:
+                self._entries.clear()
+                return
+            for key in [key for key in self._entries if key[3] != model_version]:
+                del self._entries[key]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
@@ -0,0 +1,228 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Union
+
+import numpy as np
+from numpy.typing import NDArray
+
+from ann.artifacts import save_json_atomic, save_npy_atomic
+
+# share of the catalog above which the whitelist is applied as a mask over full scores
+# instead of gathering whitelisted item vectors before scoring
+WHITELIST_GATHER_RATIO = 0.5
+
+
+def load_cached_array(path: Union[str, Path], signature: Dict[str, Any]) -> Optional[np.ndarray]:
+    """
+    Memory-maps a cached array if the signature saved next to it in <path>.json matches the expected one
+
+    Returns
+    -------
+    Loaded array or None if there is no cache or it is stale
+    """
+    meta_path = Path(f"{path}.json")
+    if not Path(path).exists() or not meta_path.exists():
+        return None
+    with open(meta_path, "r") as fh:
+        if json.load(fh) != signature:
+            return None
+    return np.load(path, mmap_mode="r", allow_pickle=False)
+
+
+def save_cached_array(path: Union[str, Path], array: np.ndarray, signature: Dict[str, Any]) -> np.ndarray:
+    """
+    Saves an array and its signature to <path>.json and memory-maps the saved array
+    """
+    save_npy_atomic(path, array)
+    save_json_atomic(Path(f"{path}.json"), signature)
+    return np.load(path, mmap_mode="r", allow_pickle=False)
+
+
+def top_k_indices(scores: NDArray[np.float32], top_k: int) -> NDArray[np.int64]:
+    """
+    Selects indices of top_k largest scores in every row, sorted by descending score
+
+    Parameters
+    ----------
+    scores
+        Array of scores of shape (n_queries, n_items)
+    top_k
+        Number of indices to select, clipped to n_items
+
+    Returns
+    -------
+    Array of column indices of shape (n_queries, min(top_k, n_items))
+    """
+    n_items = scores.shape[1]
+    top_k = min(top_k, n_items)
+    if top_k == 0:
+        return np.empty((scores.shape[0], 0), dtype=np.int64)
+    if top_k < n_items:
+        top = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+    else:
+        top = np.broadcast_to(np.arange(n_items), scores.shape)
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind="stable")
+    return np.take_along_axis(top, order, axis=1).astype(np.int64, copy=False)
+
+
+class ExactSearch:
+    """
+    Exact top-k search over item vectors that are prepared once in fit()
+
+    Attributes
+    ----------
+    item_vectors
+        An array of item embeddings
+    metric
+        Annoy metric the scores should agree with. Angular vectors are normalized once,
+        euclidean squared norms are cached, dot is used as is
+    sim_function
+        A callable used for metrics without a matrix product form (manhattan, hamming)
+    """
+    def __init__(
+        self,
+        item_vectors: NDArray[np.float32],
+        metric: str,
+        sim_function: Optional[Callable[[np.ndarray, np.ndarray], np.ndarray]] = None,
+    ) -> None:
+        self.item_vectors = item_vectors
+        self.metric = metric
+        self.sim_function = sim_function
+
+    @property
+    def n_items(self) -> int:
+        return self.item_vectors.shape[0]
+
+    def fit(
+        self, cache_path: Optional[Union[str, Path]] = None, cache_signature: Optional[Dict[str, Any]] = None
+    ) -> ExactSearch:
+        """
+        Prepares item vectors for scoring
+
+        Parameters
+        ----------
+        cache_path
+            Path of a .npy file with normalized vectors for the angular metric. If it exists and was
+            prepared for the same cache_signature and metric it is memory-mapped, otherwise it is written
+            after normalization and then memory-mapped, so that processes sharing the file also share its pages
+        cache_signature
+            Json serializable description of the item vectors source, e.g. its file stamp,
+            the cache is not used without it
+        """
+        vectors = np.ascontiguousarray(self.item_vectors, dtype=np.float32)
+        self.item_sq_norms: Optional[NDArray[np.float32]] = None
+        if self.metric == "angular":
+            signature = None
+            if cache_path is not None and cache_signature is not None:
+                signature = {**cache_signature, "metric": self.metric}
+                cached = load_cached_array(cache_path, signature)
+                if cached is not None and cached.shape == vectors.shape:
+                    self.prepared_vectors = cached
+                    return self
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            norms[norms == 0] = 1
+            vectors = vectors / norms
+            if signature is not None:
+                vectors = save_cached_array(cache_path, vectors, signature)
+        elif self.metric in ("euclidean", "euclidian"):
+            self.item_sq_norms = np.einsum("ij,ij->i", vectors, vectors)
+        elif self.metric != "dot" and self.sim_function is None:
+            raise ValueError(f"Metric {self.metric} requires sim_function for exact search")
+        self.prepared_vectors = vectors
+        return self
+
+    def score(
+        self, query_vectors: NDArray[np.float32], item_subset: Optional[NDArray[np.int64]] = None
+    ) -> NDArray[np.float32]:
+        """
+        Scores queries against all items or a subset of items, larger is closer
+
+        Parameters
+        ----------
+        query_vectors
+            Array of query vectors of shape (n_queries, dim)
+        item_subset
+            Internal ids of items to score, all items if None
+
+        Returns
+        -------
+        Array of scores of shape (n_queries, n_items) or (n_queries, len(item_subset))
+        """
+        queries = np.asarray(query_vectors, dtype=np.float32).reshape(-1, self.prepared_vectors.shape[1])
+        if self.metric not in ("angular", "dot", "euclidean", "euclidian"):
+            items = self.item_vectors if item_subset is None else self.item_vectors[item_subset]
+            return np.asarray(self.sim_function(queries, items), dtype=np.float32)  # type: ignore[misc]
+
+        items = self.prepared_vectors if item_subset is None else self.prepared_vectors[item_subset]
+        scores = queries @ items.T
+        if self.item_sq_norms is not None:
+            sq_norms = self.item_sq_norms if item_subset is None else self.item_sq_norms[item_subset]
+            # -||q - v||^2 up to a per-query constant, which does not change the ranking
+            scores = 2 * scores - sq_norms
+        return scores
+
+    def score_candidates(
+        self, query_vectors: NDArray[np.float32], candidates: NDArray[np.int64]
+    ) -> NDArray[np.float32]:
+        """
+        Scores every query against its own candidates, larger is closer
+
+        Parameters
+        ----------
+        query_vectors
+            Array of query vectors of shape (n_queries, dim)
+        candidates
+            Internal ids of items of shape (n_queries, n_candidates)
+
+        Returns
+        -------
+        Array of scores of shape (n_queries, n_candidates)
+        """
+        queries = np.asarray(query_vectors, dtype=np.float32).reshape(len(candidates), -1)
+        if self.metric not in ("angular", "dot", "euclidean", "euclidian"):
+            return np.stack([
+                np.asarray(self.sim_function(query[None], self.item_vectors[row]), dtype=np.float32)[0]  # type: ignore[misc]
+                for query, row in zip(queries, candidates)
+            ])
+        rows = np.asarray(self.prepared_vectors[candidates.ravel()]).reshape(*candidates.shape, -1)
+        scores = np.einsum("qd,qkd->qk", queries, rows)
+        if self.item_sq_norms is not None:
+            scores = 2 * scores - self.item_sq_norms[candidates]
+        return scores
+
+    def search(
+        self,
+        query_vectors: NDArray[np.float32],
+        top_k: int,
+        allowed_items: Optional[NDArray[np.int64]] = None,
+    ) -> NDArray[np.int64]:
+        """
+        Finds top_k closest items for every query
+
+        Parameters
+        ----------
+        query_vectors
+            Array of query vectors of shape (n_queries, dim)
+        top_k
+            Number of items to retrieve per query
+        allowed_items
+            Unique internal ids of items that are allowed to be retrieved, all items if None
+
+        Returns
+        -------
+        Array of internal item ids of shape (n_queries, min(top_k, n_allowed)) sorted by descending score
+        """
+        if allowed_items is None:
+            return top_k_indices(self.score(query_vectors), top_k)
+        if len(allowed_items) < WHITELIST_GATHER_RATIO * self.n_items:
+            top = top_k_indices(self.score(query_vectors, allowed_items), top_k)
+            return allowed_items[top]
+
+        scores = self.score(query_vectors)
+        mask = np.ones(self.n_items, dtype=bool)
+        mask[allowed_items] = False
+        scores[:, mask] = -np.inf
+        return top_k_indices(scores, min(top_k, len(allowed_items)))
@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+import numpy as np
+from annoy import AnnoyIndex # type: ignore
+from numpy.typing import NDArray
+from scipy.spatial.distance import cdist
+
+from ann.artifacts import SOURCE_KEYS, index_signature, load_index, read_vectors_and_mappings, sources_fingerprint
+from ann.recommender import AnnoyRecommender, build_annoy_index
+from ann.shared import prepare_shared_artifacts, shared_dir_lock
+
+
+def cosine_similarity(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    return 1 - cdist(x, y, metric='cosine')
+
+
+@contextmanager
+def artifact_paths(path_conf: Dict[str, Any], metric: str) -> Iterator[Dict[str, Any]]:
+    """
+    Yields the paths config as is, or paths of the shared artifacts if shared_dir is configured.
+    In the latter case the shared directory stays locked until the block exits
+    """
+    shared_dir = path_conf.get("shared_dir")
+    if not shared_dir:
+        yield path_conf
+        return
+    # the first process prepares memory-mapped artifacts, the others wait and attach to them
+    with shared_dir_lock(shared_dir):
+        yield prepare_shared_artifacts(path_conf, metric)
+
+
+def recommender_index_signature(paths: Dict[str, Any], recommender_conf: Dict[str, Any]) -> Dict[str, Any]:
+    return index_signature(
+        paths["item_vectors_path"],
+        recommender_conf["dim"],
+        recommender_conf["metric"],
+        recommender_conf["n_trees"],
+    )
+
+
+def neighbors_fingerprint(paths: Dict[str, Any], recommender_conf: Dict[str, Any]) -> str:
+    return sources_fingerprint(paths["item_vectors_path"], config={"metric": recommender_conf["metric"]})
+
+
+def user_recs_fingerprint(paths: Dict[str, Any], recommender_conf: Dict[str, Any], bruteforce: bool) -> str:
+    """
+    Fingerprint of the vectors and mappings files and the config a user recommendations table depends on
+    """
+    return sources_fingerprint(
+        *(paths[key] for key in SOURCE_KEYS),
+        config={
+            "metric": recommender_conf["metric"],
+            "n_trees": recommender_conf["n_trees"],
+            "top_k": recommender_conf["top_k"],
+            "bruteforce": bruteforce,
+        },
+    )
+
+
+def load_or_build_index(
+    paths: Dict[str, Any], recommender_conf: Dict[str, Any], item_vectors: NDArray[np.float32]
+) -> AnnoyIndex:
+    """
+    Memory-maps the saved index if it is up to date, otherwise builds one in memory without saving it
+    """
+    index = load_index(
+        paths["index_path"],
+        recommender_conf["dim"],
+        recommender_conf["metric"],
+        recommender_index_signature(paths, recommender_conf),
+    )
+    if index is None:
+        index = build_annoy_index(
+            item_vectors,
+            recommender_conf["dim"],
+            recommender_conf["metric"],
+            recommender_conf["n_trees"],
+            recommender_conf["n_jobs"],
+        )
+    return index
+
+
+def create_recommender(
+    paths: Dict[str, Any],
+    recommender_conf: Dict[str, Any],
+    version: Optional[str] = None,
+    user_recs_bruteforce: bool = False,
+) -> AnnoyRecommender:
+    """
+    Reads vectors and mappings from paths and fits a recommender configured by recommender_conf,
+    optional neighbors and user recommendations tables are attached if they are up to date.
+    The user recommendations table is attached only if it was built with user_recs_bruteforce
+    """
+    user_vectors, item_vectors, user_map, item_map = read_vectors_and_mappings(**paths)
+    recommender = AnnoyRecommender(
+        item_vectors=item_vectors,
+        user_vectors=user_vectors,
+        user_id_user_index_id_mapping=user_map,
+        item_id_item_index_id_mapping=item_map,
+        sim_function=cosine_similarity,
+        version=version,
+        **recommender_conf
+    )
+    return recommender.fit(
+        index_path=paths["index_path"],
+        index_signature=recommender_index_signature(paths, recommender_conf),
+        exact_search_path=paths.get("exact_search_path"),
+        exact_search_signature={"item_vectors": sources_fingerprint(paths["item_vectors_path"])},
+        neighbors_path=paths.get("neighbors_path"),
+        neighbors_fingerprint=neighbors_fingerprint(paths, recommender_conf),
+        user_recs_path=paths.get("user_recs_path"),
+        user_recs_fingerprint=user_recs_fingerprint(paths, recommender_conf, user_recs_bruteforce),
+    )
@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Any, Hashable, Iterable, Iterator, Mapping, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from numpy.typing import NDArray
+
+# integer ids are looked up in a dense array if its size does not exceed the number of ids times this factor
+DENSE_MAX_FILL_FACTOR = 4
+
+
+class IdMapping:
+    """
+    Bidirectional mapping between external ids and internal ids 0..n-1 backed by numpy arrays
+
+    Integer external ids that are nearly contiguous are looked up in a dense array,
+    other ids are looked up with searchsorted over a sorted copy of external ids.
+    All arrays can be saved as .npy files and memory-mapped instead of unpickling dicts.
+
+    Attributes
+    ----------
+    internal_to_external
+        External ids ordered by internal id
+    """
+    def __init__(
+        self,
+        internal_to_external: NDArray[Any],
+        sorted_external: Optional[NDArray[Any]] = None,
+        sorted_order: Optional[NDArray[np.int64]] = None,
+        dense: Optional[NDArray[np.int64]] = None,
+        dense_offset: int = 0,
+    ) -> None:
+        self.internal_to_external = internal_to_external
+        self._sorted_external = sorted_external
+        self._sorted_order = sorted_order
+        self._dense = dense
+        self._dense_offset = dense_offset
+        if dense is None and sorted_external is None:
+            self._build_lookup()
+
+    @classmethod
+    def from_dict(cls, mapping: Mapping[Hashable, int]) -> IdMapping:
+        """
+        Builds a mapping from a dict of external id -> internal id, internal ids must be 0..n-1
+        """
+        internal_ids = np.fromiter(mapping.values(), dtype=np.int64, count=len(mapping))
+        if not np.array_equal(np.sort(internal_ids), np.arange(len(mapping))):
+            raise ValueError("Internal ids must be a permutation of 0..n-1")
+        external_ids = np.array(list(mapping.keys()))
+        internal_to_external = np.empty_like(external_ids)
+        internal_to_external[internal_ids] = external_ids
+        return cls(internal_to_external)
+
+    def _build_lookup(self) -> None:
+        ids = self.internal_to_external
+        if len(ids) and np.issubdtype(ids.dtype, np.integer):
+            low, high = int(ids.min()), int(ids.max())
+            if high - low + 1 <= DENSE_MAX_FILL_FACTOR * len(ids):
+                dense = np.full(high - low + 1, -1, dtype=np.int64)
+                dense[ids - low] = np.arange(len(ids))
+                self._dense, self._dense_offset = dense, low
+                return
+        order = np.argsort(ids, kind="stable")
+        self._sorted_external, self._sorted_order = ids[order], order
+
+    def to_internal(self, external_ids: Union[Sequence[Hashable], NDArray[Any]]) -> NDArray[np.int64]:
+        """
+        Maps external ids to internal ids in bulk
+
+        Returns
+        -------
+        Array of internal ids, -1 stands for unknown external ids
+        """
+        ids = np.asarray(external_ids)
+        result = np.full(ids.shape, -1, dtype=np.int64)
+        if ids.size == 0:
+            return result
+        if self._dense is not None:
+            if not np.issubdtype(ids.dtype, np.integer):
+                return result
+            offsets = ids.astype(np.int64) - self._dense_offset
+            known = (offsets >= 0) & (offsets < len(self._dense))
+            result[known] = self._dense[offsets[known]]
+            return result
+        try:
+            positions = np.searchsorted(self._sorted_external, ids)
+        except TypeError:
+            return result
+        positions = np.minimum(positions, len(self._sorted_external) - 1)
+        known = self._sorted_external[positions] == ids
+        result[known] = self._sorted_order[positions[known]]  # type: ignore[index]
+        return result
+
+    def to_external(self, internal_ids: Union[Sequence[int], NDArray[np.int64]]) -> NDArray[Any]:
+        """
+        Maps internal ids to external ids in bulk
+        """
+        return self.internal_to_external[np.asarray(internal_ids, dtype=np.int64)]
+
+    def __getitem__(self, external_id: Hashable) -> int:
+        internal_id = int(self.to_internal([external_id])[0])
+        if internal_id < 0:
+            raise KeyError(external_id)
+        return internal_id
+
+    def __contains__(self, external_id: Hashable) -> bool:
+        return bool(self.to_internal([external_id])[0] >= 0)
+
+    def __len__(self) -> int:
+        return len(self.internal_to_external)
+
+    def __iter__(self) -> Iterator[Hashable]:
+        return iter(self.internal_to_external.tolist())
+
+    def items(self) -> Iterable[Tuple[Hashable, int]]:
+        return zip(self.internal_to_external.tolist(), range(len(self)))
+
+    def values(self) -> Iterable[int]:
+        return range(len(self))
+
+    def save(self, path: Union[str, Path]) -> None:
+        """
+        Saves the mapping as .npy files: path holds internal_to_external, <stem>.dense.npy holds
+        the dense lookup prefixed with its offset or <stem>.sorted.npy/<stem>.order.npy hold the sorted lookup
+        """
+        path = Path(path)
+        np.save(path, self.internal_to_external, allow_pickle=False)
+        for kind in ("dense", "sorted", "order"):
+            _sibling(path, kind).unlink(missing_ok=True)
+        if self._dense is not None:
+            dense = np.concatenate([np.array([self._dense_offset], dtype=np.int64), self._dense])
+            np.save(_sibling(path, "dense"), dense, allow_pickle=False)
+        else:
+            np.save(_sibling(path, "sorted"), self._sorted_external, allow_pickle=False)
+            np.save(_sibling(path, "order"), self._sorted_order, allow_pickle=False)
+
+    @classmethod
+    def load(cls, path: Union[str, Path], mmap_mode: Optional[str] = "r") -> IdMapping:
+        """
+        Loads a mapping saved with save(), arrays are memory-mapped unless mmap_mode is None.
+        Lookup arrays are rebuilt if only internal_to_external was saved
+        """
+        path = Path(path)
+        internal_to_external = np.load(path, mmap_mode=mmap_mode, allow_pickle=False)
+        if _sibling(path, "dense").exists():
+            dense = np.load(_sibling(path, "dense"), mmap_mode=mmap_mode, allow_pickle=False)
+            return cls(internal_to_external, dense=dense[1:], dense_offset=int(dense[0]))
+        if _sibling(path, "sorted").exists() and _sibling(path, "order").exists():
+            return cls(
+                internal_to_external,
+                sorted_external=np.load(_sibling(path, "sorted"), mmap_mode=mmap_mode, allow_pickle=False),
+                sorted_order=np.load(_sibling(path, "order"), mmap_mode=mmap_mode, allow_pickle=False),
+            )
+        return cls(internal_to_external)
+
+
+def _sibling(path: Path, kind: str) -> Path:
+    return path.with_name(f"{path.stem}.{kind}.npy")
+
+
+def as_id_mapping(mapping: Union[Mapping[Hashable, int], IdMapping]) -> IdMapping:
+    if isinstance(mapping, IdMapping):
+        return mapping
+    return IdMapping.from_dict(mapping)
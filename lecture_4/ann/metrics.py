@@ -0,0 +1,222 @@
+from __future__ import annotations
+
+import threading
+from bisect import bisect_left
+from functools import wraps
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+from ann.recommender import AnnoyRecommender
+
+LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096)
+
+Labels = Tuple[str, ...]
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _format_labels(self, labels: Labels, extra: Sequence[Tuple[str, str]] = ()) -> str:
+        pairs = list(zip(self.labelnames, labels)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}", *self._samples()]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, labels: Labels = (), value: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + value
+
+    def set(self, labels: Labels, value: float) -> None:
+        """
+        Sets the total of a counter that is maintained elsewhere, e.g. by the response cache
+        """
+        with self._lock:
+            self._values[labels] = value
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            return [f"{self.name}{self._format_labels(labels)} {value}" for labels, value in self._values.items()]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        self._counts: Dict[Labels, List[int]] = {}
+        self._sums: Dict[Labels, float] = {}
+
+    def observe(self, value: float, labels: Labels = ()) -> None:
+        # an observation goes to the first bucket with upper bound >= value, the last slot is +Inf
+        position = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.get(labels)
+            if counts is None:
+                counts = self._counts[labels] = [0] * (len(self.buckets) + 1)
+                self._sums[labels] = 0.0
+            counts[position] += 1
+            self._sums[labels] += value
+
+    def _samples(self) -> List[str]:
+        samples = []
+        with self._lock:
+            for labels, counts in self._counts.items():
+                cumulative = 0
+                for bound, count in zip([*map(str, self.buckets), "+Inf"], counts):
+                    cumulative += count
+                    samples.append(f"{self.name}_bucket{self._format_labels(labels, [('le', bound)])} {cumulative}")
+                samples.append(f"{self.name}_sum{self._format_labels(labels)} {self._sums[labels]}")
+                samples.append(f"{self.name}_count{self._format_labels(labels)} {cumulative}")
+        return samples
+
+
+class MetricsRegistry:
+    """
+    Service metrics rendered in the Prometheus text exposition format
+
+    Collectors registered with add_collector are called right before rendering
+    to refresh metrics whose values are kept elsewhere
+    """
+    def __init__(self) -> None:
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], None]] = []
+        self.stage_seconds = self.histogram(
+            "recsys_stage_duration_seconds", "Time spent in a recommendation stage", ["stage"]
+        )
+        self.batch_size = self.histogram(
+            "recsys_batch_size", "Number of users scored by one recommend_batch call", buckets=SIZE_BUCKETS
+        )
+        self.candidate_shortfalls = self.counter(
+            "recsys_candidate_shortfalls_total",
+            "Number of user recommendations with fewer than min(top_k, whitelist size) items",
+        )
+        self.fit_seconds = self.gauge(
+            "recsys_model_fit_seconds", "Time spent preparing the active model: index load or build, exact search", ["stage"]
+        )
+        self.request_seconds = self.histogram(
+            "recsys_request_duration_seconds", "HTTP request latency", ["path"]
+        )
+        self.requests = self.counter("recsys_requests_total", "Number of HTTP requests", ["path", "status"])
+
+    def _register(self, metric: Any) -> Any:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collector: Callable[[], None]) -> None:
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in self._collectors:
+            collector()
+        return "\n".join(line for metric in self._metrics for line in metric.render()) + "\n"
+
+
+def timed(func: Callable[..., Any], histogram: Histogram, labels: Labels) -> Callable[..., Any]:
+    @wraps(func)
+    def _timed(*args: Any, **kwargs: Any) -> Any:
+        start = perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            histogram.observe(perf_counter() - start, labels)
+    return _timed
+
+
+# recommender methods timed as stages, see instrument_recommender
+RECOMMENDER_STAGES = {
+    "_external_inputs_to_internal": "id_mapping",
+    "_map_external_users_to_internal": "user_mapping",
+    "_map_external_items_to_internal": "whitelist_mapping",
+    "_lookup_user_recs": "user_recs_lookup",
+    "_get_similar": "ann_query",
+    "_get_filtered_top": "whitelist_filter",
+    "_map_internal_to_external_id": "internal_to_external",
+    "recommend_batch": "batch",
+}
+
+
+def instrument_recommender(recommender: AnnoyRecommender, metrics: MetricsRegistry) -> AnnoyRecommender:
+    """
+    Wraps stage methods of a fitted recommender instance with timers and counters
+
+    Only the instance is patched, so a recommender that is not instrumented runs the original
+    methods and pays nothing for metrics. Must be called before the recommender starts serving,
+    since the batcher binds recommend_batch once.
+    """
+    for method, stage in RECOMMENDER_STAGES.items():
+        setattr(recommender, method, timed(getattr(recommender, method), metrics.stage_seconds, (stage,)))
+    recommender.exact_search.search = timed(  # type: ignore[assignment]
+        recommender.exact_search.search, metrics.stage_seconds, ("exact_search",)
+    )
+
+    def _count_shortfalls(recommendations: Sequence[Sequence[Any]], item_whitelist: Sequence[Any]) -> None:
+        # an empty whitelist allows the whole catalog
+        n_allowed = len(set(item_whitelist)) if len(item_whitelist) else len(recommender.item_vectors)
+        expected = min(recommender.top_k, n_allowed)
+        shortfalls = sum(len(top) < expected for top in recommendations)
+        if shortfalls:
+            metrics.candidate_shortfalls.inc(value=shortfalls)
+
+    recommend_single_user = recommender.recommend_single_user
+
+    @wraps(recommend_single_user)
+    def _recommend_single_user(user_id, item_whitelist):  # type: ignore[no-untyped-def]
+        closest = recommend_single_user(user_id, item_whitelist)
+        _count_shortfalls([closest], item_whitelist)
+        return closest
+    recommender.recommend_single_user = _recommend_single_user  # type: ignore[assignment]
+
+    recommend_batch = recommender.recommend_batch
+
+    @wraps(recommend_batch)
+    def _recommend_batch(user_ids, item_whitelist, *args, **kwargs):  # type: ignore[no-untyped-def]
+        metrics.batch_size.observe(len(user_ids))
+        recommendations, errors = recommend_batch(user_ids, item_whitelist, *args, **kwargs)
+        _count_shortfalls(list(recommendations.values()), item_whitelist)
+        return recommendations, errors
+    recommender.recommend_batch = _recommend_batch  # type: ignore[assignment]
+
+    for stage, seconds in recommender.fit_seconds.items():
+        metrics.fit_seconds.set((stage,), seconds)
+    return recommender
@@ -0,0 +1,265 @@
+from __future__ import annotations
+
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Literal, Optional, Tuple
+
+import numpy as np
+from annoy import AnnoyIndex # type: ignore
+from numpy.typing import NDArray
+
+from ann.artifacts import PathLike, save_json_atomic, save_npy_atomic, vectors_hash
+from ann.exact import ExactSearch, top_k_indices
+
+# number of scores computed at once by a block of the exact neighbor job, bounds its temporary memory
+BLOCK_SCORES = 1 << 24
+
+
+class NeighborTable:
+    """
+    Precomputed top-k neighbors of every item stored as memory-mapped .npy arrays
+
+    Attributes
+    ----------
+    ids
+        Array of shape (n_items, k) of neighbor internal ids sorted by descending score, -1 pads missing neighbors
+    scores
+        Array of shape (n_items, k) of neighbor scores, larger is closer
+    """
+    def __init__(self, ids: NDArray[np.int32], scores: NDArray[np.float32]) -> None:
+        self.ids = ids
+        self.scores = scores
+
+    @property
+    def k(self) -> int:
+        return self.ids.shape[1]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def neighbors(self, internal_iid: int) -> List[int]:
+        """
+        Returns neighbors of an item sorted by descending score
+        """
+        row = self.ids[internal_iid]
+        return row[row >= 0].tolist()
+
+    def save(self, path: PathLike, meta: Dict[str, Any]) -> None:
+        """
+        Saves ids to path, scores to <stem>.scores.npy and meta to <path>.json, every file is replaced atomically
+        """
+        save_npy_atomic(path, self.ids)
+        save_npy_atomic(_scores_path(path), self.scores)
+        save_json_atomic(_meta_path(path), meta)
+
+    @classmethod
+    def load(cls, path: PathLike, mmap_mode: Optional[str] = "r") -> Tuple[NeighborTable, Dict[str, Any]]:
+        with open(_meta_path(path), "r") as fh:
+            meta = json.load(fh)
+        return cls(
+            np.load(path, mmap_mode=mmap_mode, allow_pickle=False),
+            np.load(_scores_path(path), mmap_mode=mmap_mode, allow_pickle=False),
+        ), meta
+
+
+def _scores_path(path: PathLike) -> Path:
+    return Path(path).with_name(f"{Path(path).stem}.scores.npy")
+
+
+def _meta_path(path: PathLike) -> Path:
+    return Path(f"{path}.json")
+
+
+def load_neighbor_table(path: PathLike, fingerprint: str, n_items: int) -> Optional[NeighborTable]:
+    """
+    Memory-maps a neighbor table if it was built from the same item vectors file
+
+    Parameters
+    ----------
+    path
+        Path of the .npy file with neighbor ids
+    fingerprint
+        sources_fingerprint of the item vectors file and the metric, see ann.artifacts.sources_fingerprint
+    n_items
+        Number of item vectors
+
+    Returns
+    -------
+    Loaded table or None if there is no table or it is stale
+    """
+    if not Path(path).exists() or not _meta_path(path).exists():
+        return None
+    table, meta = NeighborTable.load(path)
+    if len(table) != n_items or meta.get("sources_fingerprint") != fingerprint:
+        return None
+    return table
+
+
+def _merge_top(
+    ids: NDArray[np.int64], scores: NDArray[np.float32], k: int
+) -> Tuple[NDArray[np.int32], NDArray[np.float32]]:
+    top = top_k_indices(scores, k)
+    top_ids = np.take_along_axis(ids, top, axis=1)
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    top_ids[~np.isfinite(top_scores)] = -1
+    return top_ids.astype(np.int32), top_scores.astype(np.float32)
+
+
+def _pad(ids: NDArray[np.int64], scores: NDArray[np.float32], k: int) -> Tuple[NDArray[np.int64], NDArray[np.float32]]:
+    missing = k - ids.shape[1]
+    if missing <= 0:
+        return ids, scores
+    return (
+        np.pad(ids, ((0, 0), (0, missing)), constant_values=-1),
+        np.pad(scores, ((0, 0), (0, missing)), constant_values=-np.inf),
+    )
+
+
+def _exact_block(
+    exact: ExactSearch, block: NDArray[np.int64], k: int, candidates: Optional[NDArray[np.int64]] = None
+) -> Tuple[NDArray[np.int64], NDArray[np.float32]]:
+    """
+    Scores items of the block against all items or candidates, excluding the items themselves
+    """
+    scores = exact.score(exact.item_vectors[block], candidates)
+    targets = np.arange(exact.n_items) if candidates is None else candidates
+    scores[block[:, None] == targets[None, :]] = -np.inf
+    top = top_k_indices(scores, k)
+    return _pad(targets[top], np.take_along_axis(scores, top, axis=1), k)
+
+
+def _annoy_block(
+    exact: ExactSearch, index: AnnoyIndex, block: NDArray[np.int64], k: int, search_k: int
+) -> Tuple[NDArray[np.int64], NDArray[np.float32]]:
+    """
+    Queries the Annoy index for items of the block, neighbors are scored exactly to be comparable with exact ones
+    """
+    ids = np.full((len(block), k), -1, dtype=np.int64)
+    for row, item in enumerate(block.tolist()):
+        found = [neighbor for neighbor in index.get_nns_by_item(item, k + 1, search_k=search_k) if neighbor != item][:k]
+        ids[row, :len(found)] = found
+    scores = exact.score_candidates(exact.item_vectors[block], np.maximum(ids, 0))
+    scores[ids < 0] = -np.inf
+    return ids, scores
+
+
+def compute_neighbors(
+    exact: ExactSearch,
+    k: int,
+    items: NDArray[np.int64],
+    method: Literal["exact", "annoy"] = "exact",
+    index: Optional[AnnoyIndex] = None,
+    search_k: int = -1,
+    n_jobs: int = -1,
+) -> Tuple[NDArray[np.int32], NDArray[np.float32]]:
+    """
+    Computes top-k neighbors of the given items in parallel over blocks of items
+
+    Parameters
+    ----------
+    exact
+        Fitted exact search over all item vectors
+    k
+        Number of neighbors per item
+    items
+        Internal ids of items to compute neighbors of
+    method
+        "exact" scores blocks of items against the whole catalog with one matrix product each,
+        "annoy" queries the Annoy index, which is faster for large catalogs but approximate
+    index
+        Annoy index over the same item vectors, required for the annoy method
+    search_k
+        Number of tree nodes to inspect in the annoy method
+    n_jobs
+        Number of threads, -1 means the number of cpus
+
+    Returns
+    -------
+    ids
+        Array of shape (len(items), k) of neighbor internal ids, -1 pads missing neighbors
+    scores
+        Array of shape (len(items), k) of neighbor scores
+    """
+    if method == "annoy" and index is None:
+        raise ValueError("The annoy method requires an index")
+    block_size = max(1, min(4096, BLOCK_SCORES // max(exact.n_items, 1)))
+    blocks = [items[start:start + block_size] for start in range(0, len(items), block_size)]
+
+    def _compute(block: NDArray[np.int64]) -> Tuple[NDArray[np.int32], NDArray[np.float32]]:
+        if method == "annoy":
+            return _merge_top(*_annoy_block(exact, index, block, k, search_k), k)
+        return _merge_top(*_exact_block(exact, block, k), k)
+
+    n_threads = (os.cpu_count() or 1) if n_jobs == -1 else n_jobs
+    ids = np.full((len(items), k), -1, dtype=np.int32)
+    scores = np.full((len(items), k), -np.inf, dtype=np.float32)
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        for start, (block_ids, block_scores) in zip(
+            range(0, len(items), block_size), executor.map(_compute, blocks)
+        ):
+            ids[start:start + len(block_ids)] = block_ids
+            scores[start:start + len(block_ids)] = block_scores
+    return ids, scores
+
+
+def build_neighbor_table(
+    path: PathLike,
+    exact: ExactSearch,
+    k: int,
+    method: Literal["exact", "annoy"] = "exact",
+    index: Optional[AnnoyIndex] = None,
+    search_k: int = -1,
+    n_jobs: int = -1,
+    incremental: bool = True,
+    fingerprint: Optional[str] = None,
+) -> Tuple[NeighborTable, int]:
+    """
+    Builds the neighbor table of all items or refreshes an existing one for newly added items
+
+    A refresh is possible if the existing table was built with the same k, method and metric from vectors
+    that are a prefix of the current ones, i.e. new items were appended to the end. Then only new items get
+    their neighbors computed, and neighbor lists of old items are merged with new items they are close to,
+    which are found by scoring old items against new ones only. The prefix is checked by content hash,
+    while the service checks the cheaper fingerprint of the vectors file saved along with the table.
+
+    Returns
+    -------
+    The saved table and the number of items whose neighbor lists were computed from scratch
+    """
+    n_items = exact.n_items
+    k = min(k, n_items - 1)
+    meta = {"k": k, "method": method, "metric": exact.metric, "n_items": n_items}
+    old: Optional[NeighborTable] = None
+    if incremental and Path(path).exists() and _meta_path(path).exists():
+        old, old_meta = NeighborTable.load(path, mmap_mode=None)
+        if (
+            any(old_meta.get(key) != meta[key] for key in ("k", "method", "metric"))
+            or len(old) > n_items
+            or old_meta.get("vectors_sha256") != vectors_hash(exact.item_vectors, len(old))
+        ):
+            old = None
+
+    n_old = 0 if old is None else len(old)
+    new_items = np.arange(n_old, n_items, dtype=np.int64)
+    new_ids, new_scores = compute_neighbors(exact, k, new_items, method, index, search_k, n_jobs)
+    if old is None:
+        ids, scores = new_ids, new_scores
+    else:
+        ids, scores = np.array(old.ids, dtype=np.int32), np.array(old.scores, dtype=np.float32)
+        if len(new_items):
+            block_size = max(1, min(4096, BLOCK_SCORES // len(new_items)))
+            for start in range(0, n_old, block_size):
+                block = np.arange(start, min(start + block_size, n_old), dtype=np.int64)
+                candidate_ids, candidate_scores = _exact_block(exact, block, min(k, len(new_items)), new_items)
+                ids[block], scores[block] = _merge_top(
+                    np.hstack([ids[block], candidate_ids]), np.hstack([scores[block], candidate_scores]), k
+                )
+        ids, scores = np.vstack([ids, new_ids]), np.vstack([scores, new_scores])
+
+    table = NeighborTable(ids, scores)
+    table.save(
+        path, {**meta, "vectors_sha256": vectors_hash(exact.item_vectors), "sources_fingerprint": fingerprint}
+    )
+    return table, len(new_items)
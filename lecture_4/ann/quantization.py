@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Union
+
+import numpy as np
+from numpy.typing import NDArray
+
+from ann.exact import ExactSearch, load_cached_array, save_cached_array, top_k_indices
+
+# metrics that are scored with a matrix product and therefore can be scored over int8 codes
+QUANTIZABLE_METRICS = ("angular", "dot", "euclidean", "euclidian")
+
+
+class QuantizedExactSearch(ExactSearch):
+    """
+    Exact search that keeps int8 scalar quantized item vectors in memory instead of float32 ones
+
+    Every dimension is scaled to [-127, 127] symmetrically, so a dot product with a query is
+    the product of the query multiplied by the per dimension scales and the codes. Codes are
+    scored in blocks of block_size items, which bounds the temporary float32 memory, and
+    top_k * rerank_factor candidates are then re-ranked with full precision rows of item_vectors.
+    Full precision vectors are only read for these candidates, so with memory-mapped .npy
+    item vectors only the codes (a quarter of float32 vectors) stay resident.
+    Metrics without a matrix product form fall back to ExactSearch.
+
+    Attributes
+    ----------
+    rerank_factor
+        Number of candidates re-ranked with full precision vectors per requested item
+    block_size
+        Number of items dequantized at once while scoring
+    """
+    def __init__(
+        self,
+        item_vectors: NDArray[np.float32],
+        metric: str,
+        sim_function: Optional[Callable[[np.ndarray, np.ndarray], np.ndarray]] = None,
+        rerank_factor: int = 4,
+        block_size: int = 65536,
+    ) -> None:
+        super().__init__(item_vectors, metric, sim_function)
+        self.rerank_factor = rerank_factor
+        self.block_size = block_size
+        self.codes: Optional[NDArray[np.int8]] = None
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Resident memory of the prepared store
+        """
+        if self.codes is None:
+            return self.prepared_vectors.nbytes
+        extra = self.item_sq_norms if self.item_sq_norms is not None else self.inv_norms
+        return self.codes.nbytes + self.scales.nbytes + (0 if extra is None else extra.nbytes)
+
+    def fit(
+        self, cache_path: Optional[Union[str, Path]] = None, cache_signature: Optional[Dict[str, Any]] = None
+    ) -> QuantizedExactSearch:
+        """
+        Quantizes item vectors block by block
+
+        Parameters
+        ----------
+        cache_path
+            Path of the .npy file ExactSearch would cache prepared vectors in. Codes and scales are cached
+            next to it as <stem>.int8.npy and <stem>.scales.npy and memory-mapped, so that processes
+            sharing the files also share their pages
+        cache_signature
+            Json serializable description of the item vectors source, cached codes are reused only
+            if they were computed for the same signature and metric, see ExactSearch.fit
+        """
+        if self.metric not in QUANTIZABLE_METRICS:
+            super().fit(cache_path, cache_signature)
+            return self
+        n_items = self.n_items
+        self.item_sq_norms = None
+        self.inv_norms: Optional[NDArray[np.float32]] = None
+        if self.metric == "angular":
+            self.inv_norms = np.empty(n_items, dtype=np.float32)
+            for start in range(0, n_items, self.block_size):
+                norms = np.linalg.norm(np.asarray(self.item_vectors[start:start + self.block_size], dtype=np.float32), axis=1)
+                norms[norms == 0] = 1
+                self.inv_norms[start:start + self.block_size] = 1 / norms
+        elif self.metric != "dot":
+            self.item_sq_norms = np.empty(n_items, dtype=np.float32)
+            for start in range(0, n_items, self.block_size):
+                block = np.asarray(self.item_vectors[start:start + self.block_size], dtype=np.float32)
+                self.item_sq_norms[start:start + self.block_size] = np.einsum("ij,ij->i", block, block)
+
+        codes_path = scales_path = signature = None
+        if cache_path is not None and cache_signature is not None:
+            cache_path = Path(cache_path)
+            codes_path = cache_path.with_name(f"{cache_path.stem}.int8.npy")
+            scales_path = cache_path.with_name(f"{cache_path.stem}.scales.npy")
+            signature = {**cache_signature, "metric": self.metric}
+            codes = load_cached_array(codes_path, signature)
+            scales = load_cached_array(scales_path, signature)
+            if codes is not None and scales is not None \
+                    and codes.shape == self.item_vectors.shape and codes.dtype == np.int8:
+                self.codes, self.scales = codes, np.asarray(scales)
+                return self
+
+        max_abs = np.zeros(self.item_vectors.shape[1], dtype=np.float32)
+        for start in range(0, n_items, self.block_size):
+            max_abs = np.maximum(max_abs, np.abs(self._prepared_block(start, start + self.block_size)).max(axis=0))
+        max_abs[max_abs == 0] = 1
+        self.scales = (max_abs / 127).astype(np.float32)
+        codes = np.empty(self.item_vectors.shape, dtype=np.int8)
+        for start in range(0, n_items, self.block_size):
+            codes[start:start + self.block_size] = np.rint(
+                self._prepared_block(start, start + self.block_size) / self.scales
+            ).astype(np.int8)
+        if codes_path is not None and scales_path is not None and signature is not None:
+            save_cached_array(scales_path, self.scales, signature)
+            codes = save_cached_array(codes_path, codes, signature)
+        self.codes = codes
+        return self
+
+    def _prepared_block(self, start: int, stop: int) -> NDArray[np.float32]:
+        block = np.asarray(self.item_vectors[start:stop], dtype=np.float32)
+        if self.inv_norms is not None:
+            block = block * self.inv_norms[start:stop, None]
+        return block
+
+    def score(
+        self, query_vectors: NDArray[np.float32], item_subset: Optional[NDArray[np.int64]] = None
+    ) -> NDArray[np.float32]:
+        """
+        Scores queries against int8 codes of all items or a subset of items, larger is closer.
+        Scores are approximate, search() re-ranks the best of them with full precision vectors
+        """
+        if self.codes is None:
+            return super().score(query_vectors, item_subset)
+        queries = np.asarray(query_vectors, dtype=np.float32).reshape(-1, self.codes.shape[1])
+        scaled_queries = queries * self.scales
+        n_scored = self.n_items if item_subset is None else len(item_subset)
+        scores = np.empty((len(queries), n_scored), dtype=np.float32)
+        for start in range(0, n_scored, self.block_size):
+            stop = min(start + self.block_size, n_scored)
+            codes = self.codes[start:stop] if item_subset is None else self.codes[item_subset[start:stop]]
+            scores[:, start:stop] = scaled_queries @ codes.astype(np.float32).T
+        if self.item_sq_norms is not None:
+            sq_norms = self.item_sq_norms if item_subset is None else self.item_sq_norms[item_subset]
+            scores = 2 * scores - sq_norms
+        return scores
+
+    def search(
+        self,
+        query_vectors: NDArray[np.float32],
+        top_k: int,
+        allowed_items: Optional[NDArray[np.int64]] = None,
+    ) -> NDArray[np.int64]:
+        """
+        Finds top_k * rerank_factor candidates by int8 scores and re-ranks them with full precision vectors,
+        see ExactSearch.search
+        """
+        if self.codes is None:
+            return super().search(query_vectors, top_k, allowed_items)
+        queries = np.asarray(query_vectors, dtype=np.float32).reshape(-1, self.codes.shape[1])
+        candidates = super().search(queries, top_k * self.rerank_factor, allowed_items)
+        if candidates.shape[1] == 0:
+            return candidates
+        top = top_k_indices(self.score_candidates(queries, candidates), top_k)
+        return np.take_along_axis(candidates, top, axis=1)
+
+    def score_candidates(
+        self, query_vectors: NDArray[np.float32], candidates: NDArray[np.int64]
+    ) -> NDArray[np.float32]:
+        """
+        Scores every query against its own candidates with full precision vectors, see ExactSearch.score_candidates
+        """
+        if self.codes is None:
+            return super().score_candidates(query_vectors, candidates)
+        queries = np.asarray(query_vectors, dtype=np.float32).reshape(len(candidates), -1)
+        rows = np.asarray(self.item_vectors[candidates.ravel()], dtype=np.float32).reshape(*candidates.shape, -1)
+        scores = np.einsum("qd,qkd->qk", queries, rows)
+        if self.inv_norms is not None:
+            scores *= self.inv_norms[candidates]
+        elif self.item_sq_norms is not None:
+            scores = 2 * scores - self.item_sq_norms[candidates]
+        return scores
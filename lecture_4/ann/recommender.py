@@ -1,12 +1,32 @@
 from __future__ import annotations
 
+import os
+from concurrent.futures import ThreadPoolExecutor
 from itertools import islice
-from typing import Callable, Dict, Hashable, Literal, Sequence, Tuple
+from time import perf_counter
+from typing import AbstractSet, Any, Callable, Dict, Hashable, List, Literal, Mapping, Optional, Sequence, Tuple, Union
 
 import numpy as np
 from annoy import AnnoyIndex # type: ignore
 from numpy.typing import NDArray
 
+from ann.artifacts import PathLike, load_index, save_index
+from ann.exact import ExactSearch
+from ann.quantization import QuantizedExactSearch
+from ann.mappings import IdMapping, as_id_mapping
+from ann.neighbors import NeighborTable, load_neighbor_table
+from ann.user_recs import UserRecsTable, load_user_recs_table
+
+
+def build_annoy_index(
+    item_vectors: NDArray[np.float32], dim: int, metric: str, n_trees: int, n_jobs: int = -1
+) -> AnnoyIndex:
+    index = AnnoyIndex(f=dim, metric=metric)
+    for idx, vector in enumerate(item_vectors):
+        index.add_item(idx, vector)
+    index.build(n_trees=n_trees, n_jobs=n_jobs)
+    return index
+
 
 class AnnoyRecommender:
     """
@@ -19,38 +39,65 @@ class AnnoyRecommender:
     user_vectors
         An array of user embeddings
     uid_uiid_mapping
-        Mapping from external user ids to internal user ids
+        Array-backed mapping from external user ids to internal user ids
     iid_iiid_mapping
-        Mapping from external item ids to internal item ids
+        Array-backed mapping from external item ids to internal item ids
     uiid_uid_mapping
-        Mapping from internal user ids to external user ids
+        Array of external user ids indexed by internal user ids
     iiid_iid_mapping
-        Mapping from internal item ids to external item ids
+        Array of external item ids indexed by internal item ids
     top_k
         Number of recommendations to yield
     dim
         Dimensionality of user/item embeddings
     sim_function
-        A callable that computes similarity measure between 2 sets of vectors
+        A callable that computes similarity measure between 2 sets of vectors,
+        used by bruteforce search only for metrics without a matrix product form (manhattan, hamming)
     metric
         Annoy metric (for more details visit https://github.com/spotify/annoy)
     n_trees
         Number of trees in annoy index (for more details visit https://github.com/spotify/annoy)
     n_jobs
-        Number of cpus Annoy gonna use while building an index (for more details visit https://github.com/spotify/annoy)
+        Number of cpus Annoy gonna use while building an index (for more details visit https://github.com/spotify/annoy),
+        also the number of threads of the pool that queries the index in batch mode
     search_k
         Number of tree nodes to inspect (for more details visit https://github.com/spotify/annoy)
     n_neighbors
         Number of neighbors to retrieve from the index (for more details visit https://github.com/spotify/annoy)
+    batch_size
+        Number of users scored with a single matrix product in batch bruteforce mode
+    adaptive_retrieval
+        If True, the candidate pool grows geometrically until top_k items pass the whitelist
+        and small whitelists are scored exactly instead of querying the Annoy index
+    exact_whitelist_ratio
+        Share of the catalog up to which a whitelist is scored exactly in adaptive retrieval mode
+    candidates_growth
+        Factor the candidate pool is multiplied by on every retry in adaptive retrieval mode
+    quantization
+        Item vectors store of exact search: None keeps float32 vectors, "int8" keeps int8 scalar quantized
+        vectors and re-ranks candidates with full precision ones, see ann.quantization.QuantizedExactSearch
+    rerank_factor
+        Number of candidates re-ranked with full precision vectors per recommended item with quantization
     index
         Annoy index
+    exact_search
+        Exact search engine over prenormalized float32 item vectors used by bruteforce methods
+    neighbors
+        Precomputed item neighbors table used by recommend_similar_items, None if it is not available
+    user_recs
+        Precomputed recommendations of every user served before falling back to a live search,
+        cold users get popular items from it. None if it is not available
+    fit_seconds
+        Time fit() spent loading or building (and saving) the index and preparing exact search
+    version
+        Identifier of the model artifacts the recommender was created from, see ann.artifacts.model_version
     """
     def __init__(
         self,
         item_vectors: NDArray[np.float32],
         user_vectors: NDArray[np.float32],
-        user_id_user_index_id_mapping: Dict[Hashable, int],
-        item_id_item_index_id_mapping: Dict[Hashable, int],
+        user_id_user_index_id_mapping: Union[Mapping[Hashable, int], IdMapping],
+        item_id_item_index_id_mapping: Union[Mapping[Hashable, int], IdMapping],
         top_k: int,
         dim: int,
         sim_function: Callable[[np.ndarray, np.ndarray], np.ndarray],
@@ -59,13 +106,20 @@ class AnnoyRecommender:
         n_jobs: int = -1,
         search_k: int = -1,
         n_neighbors: int = 500,
+        batch_size: int = 1024,
+        adaptive_retrieval: bool = False,
+        exact_whitelist_ratio: float = 0.05,
+        candidates_growth: int = 4,
+        quantization: Optional[Literal['int8']] = None,
+        rerank_factor: int = 4,
+        version: Optional[str] = None,
     ) -> None:
         self.item_vectors = item_vectors
         self.user_vectors = user_vectors
-        self.uid_uiid_mapping = user_id_user_index_id_mapping
-        self.iid_iiid_mapping = item_id_item_index_id_mapping
-        self.uiid_uid_mapping = {v: k for k, v in user_id_user_index_id_mapping.items()}
-        self.iiid_iid_mapping = {v: k for k, v in item_id_item_index_id_mapping.items()}
+        self.uid_uiid_mapping = as_id_mapping(user_id_user_index_id_mapping)
+        self.iid_iiid_mapping = as_id_mapping(item_id_item_index_id_mapping)
+        self.uiid_uid_mapping = self.uid_uiid_mapping.internal_to_external
+        self.iiid_iid_mapping = self.iid_iiid_mapping.internal_to_external
         self.top_k = top_k
         self.dim = dim
         self.sim_function = sim_function
@@ -74,43 +128,389 @@ class AnnoyRecommender:
         self.n_jobs = n_jobs
         self.search_k = search_k
         self.n_neighbors = n_neighbors
+        self.batch_size = batch_size
+        self.adaptive_retrieval = adaptive_retrieval
+        self.exact_whitelist_ratio = exact_whitelist_ratio
+        self.candidates_growth = candidates_growth
+        if quantization not in (None, 'int8'):
+            raise ValueError(f"Unknown quantization {quantization}, expected None or 'int8'")
+        self.quantization = quantization
+        self.rerank_factor = rerank_factor
+        self.version = version
+        # threads are started lazily on the first batch, and shared by all batches of the recommender
+        self._executor = ThreadPoolExecutor(
+            max_workers=(os.cpu_count() or 1) if n_jobs == -1 else n_jobs, thread_name_prefix="annoy"
+        )
+
+    def fit(
+        self,
+        index_path: Optional[PathLike] = None,
+        index_signature: Optional[Dict[str, Any]] = None,
+        exact_search_path: Optional[PathLike] = None,
+        exact_search_signature: Optional[Dict[str, Any]] = None,
+        neighbors_path: Optional[PathLike] = None,
+        neighbors_fingerprint: Optional[str] = None,
+        user_recs_path: Optional[PathLike] = None,
+        user_recs_fingerprint: Optional[str] = None,
+    ) -> AnnoyRecommender:
+        """
+        Prepares the Annoy index and the exact search engine
 
-    def fit(self) -> AnnoyRecommender:
-        self._build_index()
+        Parameters
+        ----------
+        index_path
+            Path of a persisted Annoy index. If the index there matches index_signature
+            it is memory-mapped, otherwise the index is rebuilt and saved to this path
+        index_signature
+            Signature of vectors and config the index must match, see ann.artifacts.index_signature
+        exact_search_path
+            Path of a .npy file to memory-map prepared item vectors of the exact search engine from,
+            see ExactSearch.fit
+        exact_search_signature
+            Signature of the item vectors source the prepared vectors at exact_search_path must match
+        neighbors_path
+            Path of a neighbor table built by build_neighbors.py, it is memory-mapped if it was built
+            from the current item vectors, otherwise similar items are retrieved from the Annoy index
+        neighbors_fingerprint
+            sources_fingerprint of the item vectors file and the metric, required with neighbors_path
+        user_recs_path
+            Path of a user recommendations table built by build_user_recs.py, it is memory-mapped
+            if it was built from the same vectors and mappings files and config
+        user_recs_fingerprint
+            Fingerprint of the vectors and mappings files and the config, required with user_recs_path
+        """
+        self.fit_seconds: Dict[str, float] = {}
+        start = perf_counter()
+        index = None
+        if index_path is not None and index_signature is not None:
+            index = load_index(index_path, self.dim, self.metric, index_signature)
+        if index is not None:
+            self.index = index
+            self.fit_seconds["index_load"] = perf_counter() - start
+        else:
+            start = perf_counter()
+            self._build_index()
+            self.fit_seconds["index_build"] = perf_counter() - start
+            if index_path is not None and index_signature is not None:
+                start = perf_counter()
+                save_index(self.index, index_path, index_signature)
+                self.fit_seconds["index_save"] = perf_counter() - start
+        start = perf_counter()
+        if self.quantization == 'int8':
+            self.exact_search = QuantizedExactSearch(
+                self.item_vectors, self.metric, self.sim_function, rerank_factor=self.rerank_factor
+            ).fit(exact_search_path, exact_search_signature)
+        else:
+            self.exact_search = ExactSearch(self.item_vectors, self.metric, self.sim_function).fit(
+                exact_search_path, exact_search_signature
+            )
+        self.fit_seconds["exact_search"] = perf_counter() - start
+        self.neighbors: Optional[NeighborTable] = None
+        if neighbors_path is not None and neighbors_fingerprint is not None:
+            self.neighbors = load_neighbor_table(neighbors_path, neighbors_fingerprint, len(self.item_vectors))
+        self.user_recs: Optional[UserRecsTable] = None
+        if user_recs_path is not None and user_recs_fingerprint is not None:
+            self.user_recs = load_user_recs_table(user_recs_path, user_recs_fingerprint, len(self.user_vectors))
         return self
 
+    def close(self) -> None:
+        """
+        Stops the threads that query the index in batch mode, the recommender must not be used afterwards
+        """
+        self._executor.shutdown(wait=False)
+
     def _build_index(self) -> None:
-        index = AnnoyIndex(f=self.dim, metric=self.metric)
-        for idx, vector in enumerate(self.item_vectors):
-            index.add_item(idx, vector)
-        index.build(n_trees=self.n_trees, n_jobs=self.n_jobs)
-        self.index = index
+        self.index = build_annoy_index(self.item_vectors, self.dim, self.metric, self.n_trees, self.n_jobs)
 
     def recommend_single_user(
         self, user_id: Hashable, item_whitelist: Sequence[Hashable]
     ) -> Sequence[Hashable]:
+        if self.user_recs is not None and user_id not in self.uid_uiid_mapping:
+            allowed_items = self._to_allowed_array(self._map_external_items_to_internal(item_whitelist))
+            return self._map_internal_to_external_id(self.user_recs.popular_top(allowed_items, self.top_k))
         internal_uid, internal_item_whitelist = self._external_inputs_to_internal(user_id, item_whitelist)
-        if len(item_whitelist) == 0:
-            internal_item_whitelist = list(self.iid_iiid_mapping.values())
-        user_vector = self.user_vectors[internal_uid, :].flatten()
-
-        closest = self._get_similar(user_vector=user_vector)
-        closest = self._get_filtered_top(
-            candidates=closest, allowed_items=internal_item_whitelist
-        )
+        allowed_items = self._to_allowed_set(internal_item_whitelist)
+        closest = self._lookup_user_recs(internal_uid, allowed_items)
+        if closest is None:
+            closest = self._retrieve(
+                user_vector=self.user_vectors[internal_uid, :].flatten(), allowed_items=allowed_items
+            )
         return self._map_internal_to_external_id(closest)
     
     def recommend_bruteforce_single_user(self, user_id: Hashable, item_whitelist: Sequence[Hashable]) -> Sequence[Hashable]:
         internal_uid, internal_item_whitelist = self._external_inputs_to_internal(user_id, item_whitelist)
-        if len(item_whitelist) == 0:
-            internal_item_whitelist = list(self.iid_iiid_mapping.values())
         user_vector = self.user_vectors[internal_uid, :].reshape(1, -1)
-        closest = self.sim_function(user_vector, self.item_vectors)
-        closest = np.argsort(-closest).flatten().tolist()
-        closest = self._get_filtered_top(
-            candidates=closest, allowed_items=internal_item_whitelist
+        closest = self.exact_search.search(
+            user_vector, self.top_k, allowed_items=self._to_allowed_array(internal_item_whitelist)
         )
-        return self._map_internal_to_external_id(closest)
+        return self._map_internal_to_external_id(closest[0].tolist())
+
+    def recommend_similar_items(
+        self, item_id: Hashable, item_whitelist: Sequence[Hashable]
+    ) -> Sequence[Hashable]:
+        """
+        Yields top_k items most similar to a given one, looked up in the neighbor table if it is available
+
+        Raises
+        ------
+        KeyError
+            If the item or any of the whitelisted items is unknown
+        """
+        internal_iid = self.iid_iiid_mapping[item_id]
+        allowed_items = self._to_allowed_set(self._map_external_items_to_internal(item_whitelist))
+        if self.neighbors is not None:
+            candidates = self.neighbors.neighbors(internal_iid)
+        else:
+            candidates = [
+                neighbor
+                for neighbor in self.index.get_nns_by_item(internal_iid, self.n_neighbors + 1, search_k=self.search_k)
+                if neighbor != internal_iid
+            ]
+        if allowed_items is None:
+            return self._map_internal_to_external_id(candidates[:self.top_k])
+        return self._map_internal_to_external_id(
+            self._get_filtered_top(candidates=candidates, allowed_items=allowed_items)
+        )
+
+    def recommend_batch(
+        self,
+        user_ids: Sequence[Hashable],
+        item_whitelist: Sequence[Hashable],
+        bruteforce: bool = False,
+    ) -> Tuple[Dict[Hashable, Sequence[Hashable]], Dict[Hashable, str]]:
+        """
+        Yields recommendations for many users at once
+
+        Parameters
+        ----------
+        user_ids
+            External ids of users to recommend for
+        item_whitelist
+            External ids of items that are allowed to be recommended, shared by all users
+        bruteforce
+            If True, users are scored against all items with one matrix product per block
+            of batch_size users, otherwise the Annoy index is queried by n_jobs threads
+
+        Returns
+        -------
+        recommendations
+            Mapping from external user id to recommended external item ids
+        errors
+            Mapping from external user id to an error description for users that could not be served
+
+        Raises
+        ------
+        KeyError
+            If any of the whitelisted items is unknown
+        """
+        internal_item_whitelist = self._map_external_items_to_internal(item_whitelist)
+
+        mapped_uids = self._map_external_users_to_internal(user_ids)
+        known = mapped_uids >= 0
+        known_user_ids = [user_id for user_id, is_known in zip(user_ids, known) if is_known]
+        internal_uids = mapped_uids[known].tolist()
+
+        if bruteforce:
+            closest = self._get_bruteforce_top_batch(internal_uids, internal_item_whitelist)
+        else:
+            closest = self._get_similar_top_batch(internal_uids, internal_item_whitelist)
+        known_recommendations = {
+            user_id: self._map_internal_to_external_id(top) for user_id, top in zip(known_user_ids, closest)
+        }
+
+        # cold users get popular items if the user recommendations table is loaded, results keep the order of user_ids
+        popular: Optional[Sequence[Hashable]] = None
+        if self.user_recs is not None and not known.all():
+            popular = self._map_internal_to_external_id(
+                self.user_recs.popular_top(self._to_allowed_array(internal_item_whitelist), self.top_k)
+            )
+        errors: Dict[Hashable, str] = {}
+        recommendations: Dict[Hashable, Sequence[Hashable]] = {}
+        for user_id, is_known in zip(user_ids, known):
+            if is_known:
+                recommendations[user_id] = known_recommendations[user_id]
+            elif popular is not None:
+                recommendations[user_id] = popular
+            else:
+                errors[user_id] = "User not found"
+        return recommendations, errors
+
+    def _get_similar_top_batch(
+        self, internal_uids: Sequence[int], allowed_items: Sequence[int]
+    ) -> List[Sequence[int]]:
+        """
+        Queries the Annoy index for every user in parallel, Annoy releases the GIL while searching
+
+        Parameters
+        ----------
+        internal_uids
+            Internal ids of users
+        allowed_items
+            A sequence of items allowed to recommend, empty means all items
+
+        Returns
+        -------
+        A list of filtered top_k recommendations per user
+        """
+        allowed_items_set = self._to_allowed_set(allowed_items)
+        closest = [self._lookup_user_recs(internal_uid, allowed_items_set) for internal_uid in internal_uids]
+        missing = [position for position, top in enumerate(closest) if top is None]
+        if not missing:
+            return closest  # type: ignore[return-value]
+
+        def _recommend(internal_uid: int) -> Sequence[int]:
+            return self._retrieve(
+                user_vector=self.user_vectors[internal_uid, :].flatten(), allowed_items=allowed_items_set
+            )
+
+        missing_uids = [internal_uids[position] for position in missing]
+        # a single user is answered inline, handing it over to a pool thread costs more than the query
+        found = map(_recommend, missing_uids) if len(missing) == 1 else self._executor.map(_recommend, missing_uids)
+        for position, top in zip(missing, found):
+            closest[position] = top  # type: ignore[call-overload]
+        return closest  # type: ignore[return-value]
+
+    def _lookup_user_recs(
+        self, internal_uid: int, allowed_items: Optional[AbstractSet[int]]
+    ) -> Optional[Sequence[int]]:
+        """
+        Serves a user from the precomputed recommendations table
+
+        Returns
+        -------
+        top_k precomputed recommendations that pass the whitelist, None if there is no table
+        or too few of them pass the whitelist and a live search is needed
+        """
+        if self.user_recs is None:
+            return None
+        return self.user_recs.lookup(internal_uid, allowed_items, self.top_k)
+
+    def recommend_internal_top_n(
+        self, internal_uids: NDArray[np.int64], n: int, bruteforce: bool = False
+    ) -> NDArray[np.int32]:
+        """
+        Retrieves top n items for every user without whitelist filtering, used to precompute recommendations
+
+        Parameters
+        ----------
+        internal_uids
+            Internal ids of users
+        n
+            Number of items to retrieve per user
+        bruteforce
+            If True, blocks of batch_size users are scored exactly, otherwise the Annoy index
+            is queried by n_jobs threads
+
+        Returns
+        -------
+        Array of internal item ids of shape (len(internal_uids), n), -1 pads missing items
+        """
+        top = np.full((len(internal_uids), n), -1, dtype=np.int32)
+        if bruteforce:
+            for start in range(0, len(internal_uids), self.batch_size):
+                block = np.asarray(internal_uids[start:start + self.batch_size], dtype=np.int64)
+                found = self.exact_search.search(self.user_vectors[block], n)
+                top[start:start + len(block), :found.shape[1]] = found
+            return top
+
+        def _recommend(internal_uid: int) -> Sequence[int]:
+            return self._get_similar(self.user_vectors[internal_uid, :].flatten(), n_neighbors=n)[:n]
+
+        for row, found in enumerate(self._executor.map(_recommend, np.asarray(internal_uids).tolist())):
+            top[row, :len(found)] = found
+        return top
+
+    def _get_bruteforce_top_batch(
+        self, internal_uids: Sequence[int], allowed_items: Sequence[int]
+    ) -> List[Sequence[int]]:
+        """
+        Scores blocks of batch_size users against allowed items with a single matrix product per block
+
+        Parameters
+        ----------
+        internal_uids
+            Internal ids of users
+        allowed_items
+            A sequence of items allowed to recommend, empty means all items
+
+        Returns
+        -------
+        A list of filtered top_k recommendations per user
+        """
+        allowed_items_arr = self._to_allowed_array(allowed_items)
+        result: List[Sequence[int]] = []
+        for start in range(0, len(internal_uids), self.batch_size):
+            block = np.asarray(internal_uids[start:start + self.batch_size], dtype=np.int64)
+            top = self.exact_search.search(self.user_vectors[block], self.top_k, allowed_items=allowed_items_arr)
+            result.extend(top.tolist())
+        return result
+
+    def _retrieve(
+        self, user_vector: NDArray[np.float32], allowed_items: Optional[AbstractSet[int]]
+    ) -> Sequence[int]:
+        """
+        Retrieves top_k allowed items for a user from the Annoy index
+
+        Parameters
+        ----------
+        user_vector
+            Numpy array of user's vector representation
+        allowed_items
+            A set of items allowed to recommend, None means all items
+
+        Returns
+        -------
+        A sequence of top_k recommendations, in adaptive retrieval mode it is only shorter
+        than top_k if there are fewer allowed items
+        """
+        if allowed_items is None:
+            return self._get_similar(user_vector=user_vector)[:self.top_k]
+        if not self.adaptive_retrieval:
+            return self._get_filtered_top(
+                candidates=self._get_similar(user_vector=user_vector), allowed_items=allowed_items
+            )
+
+        n_items = len(self.item_vectors)
+        if len(allowed_items) <= self.exact_whitelist_ratio * n_items:
+            return self._get_exact_top(user_vector, allowed_items)
+
+        expected = min(self.top_k, len(allowed_items))
+        n_neighbors = self.n_neighbors
+        while True:
+            closest = self._get_filtered_top(
+                candidates=self._get_similar(user_vector=user_vector, n_neighbors=n_neighbors),
+                allowed_items=allowed_items,
+            )
+            if len(closest) >= expected:
+                return closest
+            if n_neighbors >= n_items:
+                # Annoy may miss items even when asked for the whole catalog
+                return self._get_exact_top(user_vector, allowed_items)
+            n_neighbors = min(n_neighbors * self.candidates_growth, n_items)
+
+    def _get_exact_top(self, user_vector: NDArray[np.float32], allowed_items: AbstractSet[int]) -> Sequence[int]:
+        allowed_items_arr = np.fromiter(allowed_items, dtype=np.int64, count=len(allowed_items))
+        allowed_items_arr.sort()
+        return self.exact_search.search(
+            user_vector.reshape(1, -1), self.top_k, allowed_items=allowed_items_arr
+        )[0].tolist()
+
+    @staticmethod
+    def _to_allowed_set(allowed_items: Sequence[int]) -> Optional[AbstractSet[int]]:
+        """
+        Converts internal ids of allowed items to a set, None stands for all items and costs nothing to filter by
+        """
+        if len(allowed_items) == 0:
+            return None
+        return set(allowed_items)
+
+    def _to_allowed_array(self, allowed_items: Sequence[int]) -> Optional[NDArray[np.int64]]:
+        """
+        Converts internal ids of allowed items to a sorted unique array, None stands for all items
+        """
+        if len(allowed_items) == 0:
+            return None
+        return np.unique(np.asarray(allowed_items, dtype=np.int64))
 
     def _external_inputs_to_internal(self, user_id: Hashable, item_whitelist: Sequence[Hashable]) -> Tuple[int, Sequence[int]]:
         """
@@ -131,13 +531,32 @@ class AnnoyRecommender:
             Internal ids of items that are allowed to be recommended
         """
         internal_uid = self.uid_uiid_mapping[user_id]
-        internal_item_whitelist = [
-            self.iid_iiid_mapping[item] for item in item_whitelist
-        ]
+        internal_item_whitelist = self._map_external_items_to_internal(item_whitelist)
         return internal_uid, internal_item_whitelist
 
+    def _map_external_users_to_internal(self, user_ids: Sequence[Hashable]) -> NDArray[np.int64]:
+        """
+        Maps external user ids to internal ids in one vectorized lookup, -1 stands for unknown users
+        """
+        return self.uid_uiid_mapping.to_internal(user_ids)
+
+    def _map_external_items_to_internal(self, item_whitelist: Sequence[Hashable]) -> Sequence[int]:
+        """
+        Maps external item ids to internal ids in one vectorized lookup
+
+        Raises
+        ------
+        KeyError
+            If any of the items is unknown
+        """
+        internal_items = self.iid_iiid_mapping.to_internal(item_whitelist)
+        unknown = internal_items < 0
+        if unknown.any():
+            raise KeyError(np.asarray(item_whitelist)[unknown][0])
+        return internal_items.tolist()
+
     def _get_similar(
-        self, user_vector: NDArray[np.float32]
+        self, user_vector: NDArray[np.float32], n_neighbors: Optional[int] = None
     ) -> Sequence[int]:
         """
         Gets nearest neighbors from an Annoy index
@@ -147,6 +566,8 @@ class AnnoyRecommender:
         user_vector:
             Numpy array of user's vector representation of shape (1, n),
             where n is the number of dimensions
+        n_neighbors:
+            Number of neighbors to retrieve, self.n_neighbors if None
         
         Returns
         -------
@@ -155,14 +576,14 @@ class AnnoyRecommender:
         """
         nearest_neighbors = self.index.get_nns_by_vector(
             user_vector,
-            self.n_neighbors,
+            self.n_neighbors if n_neighbors is None else n_neighbors,
             search_k=self.search_k,
             include_distances=False,
         )
         return nearest_neighbors
 
     def _get_filtered_top(
-        self, candidates: Sequence[int], allowed_items: Sequence[int]
+        self, candidates: Sequence[int], allowed_items: AbstractSet[int]
     ) -> Sequence[int]:
         """
         Takes candidates, intersects with allowed items and returns top_k similar items
@@ -172,20 +593,19 @@ class AnnoyRecommender:
         candidates:
             A sequence of candidates to recommend
         allowed_items:
-            A sequence of items allowed to recommend
+            A set of items allowed to recommend
         
         Returns
         -------
         A sequence of filtered top_k recommendations
         """
-        allowed_items_set = set(allowed_items)
         return list(
             islice(
-                (cand for cand in candidates if cand in allowed_items_set), self.top_k
+                (cand for cand in candidates if cand in allowed_items), self.top_k
             )
         )
 
     def _map_internal_to_external_id(
         self, seq_to_map: Sequence[int]
     ) -> Sequence[Hashable]:
-        return [self.iiid_iid_mapping[item] for item in seq_to_map]
+        return self.iid_iiid_mapping.to_external(seq_to_map).tolist()
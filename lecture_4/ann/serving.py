@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Any, Callable, Dict, Optional
+
+from ann.batching import MicroBatcher
+from ann.recommender import AnnoyRecommender
+
+logger = logging.getLogger(__name__)
+
+
+class ServingModel:
+    """
+    A recommender together with the micro-batcher that scores its requests
+
+    Requests hold a reference to the ServingModel they started with, so they are answered
+    by that model and report its version even if a newer model is swapped in meanwhile
+    """
+    def __init__(self, recommender: AnnoyRecommender, batching_conf: Dict[str, Any]) -> None:
+        self.recommender = recommender
+        self.batcher = MicroBatcher(recommender.recommend_batch, **batching_conf)
+
+    @property
+    def version(self) -> Optional[str]:
+        return self.recommender.version
+
+    async def stop(self) -> None:
+        """
+        Drains the batcher and releases the threads of the recommender
+        """
+        await self.batcher.stop()
+        self.recommender.close()
+
+
+class HotReloader:
+    """
+    Keeps the active ServingModel and replaces it without downtime
+
+    A new recommender is loaded and fitted in a background thread while the current one keeps serving,
+    then the active model is swapped with a single assignment and the old model is drained and stopped.
+
+    Attributes
+    ----------
+    load_recommender
+        A blocking callable that loads artifacts and returns a fitted AnnoyRecommender
+    source_version
+        A cheap blocking callable that returns the version of the artifacts on disk,
+        a reload is needed when it differs from the active model version
+    batching_conf
+        Keyword arguments of MicroBatcher
+    watch_interval_s
+        Period of polling source_version for changes, 0 disables watching
+    on_swap
+        A callable invoked with the new ServingModel right after it is swapped in
+    """
+    def __init__(
+        self,
+        load_recommender: Callable[[], AnnoyRecommender],
+        source_version: Callable[[], str],
+        batching_conf: Dict[str, Any],
+        watch_interval_s: float = 0,
+        on_swap: Optional[Callable[[ServingModel], None]] = None,
+    ) -> None:
+        self.load_recommender = load_recommender
+        self.source_version = source_version
+        self.batching_conf = batching_conf
+        self.watch_interval_s = watch_interval_s
+        self.on_swap = on_swap
+        self.model: Optional[ServingModel] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._watch_task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        self._lock = asyncio.Lock()
+        await self.reload(force=True)
+        if self.watch_interval_s > 0:
+            self._watch_task = asyncio.get_running_loop().create_task(self._watch())
+
+    async def stop(self) -> None:
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            try:
+                await self._watch_task
+            except asyncio.CancelledError:
+                pass
+            self._watch_task = None
+        if self.model is not None:
+            await self.model.stop()
+
+    async def reload(self, force: bool = False) -> bool:
+        """
+        Loads a new model and swaps it in, unless the artifacts on disk did not change and force is False
+
+        Returns
+        -------
+        True if a new model was swapped in
+        """
+        assert self._lock is not None, "HotReloader is not started"
+        loop = asyncio.get_running_loop()
+        async with self._lock:
+            if not force and self.model is not None:
+                if await loop.run_in_executor(None, self.source_version) == self.model.version:
+                    return False
+            recommender = await loop.run_in_executor(None, self.load_recommender)
+            new_model = ServingModel(recommender, self.batching_conf)
+            new_model.batcher.start()
+            old_model, self.model = self.model, new_model
+            if self.on_swap is not None:
+                self.on_swap(new_model)
+            logger.info("Model %s is active", new_model.version)
+            if old_model is not None:
+                await old_model.stop()
+            return True
+
+    async def _watch(self) -> None:
+        while True:
+            await asyncio.sleep(self.watch_interval_s)
+            try:
+                await self.reload()
+            except Exception:  # pylint: disable=broad-except
+                # the active model keeps serving, the reload is retried on the next poll
+                logger.exception("Failed to reload the model")
@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+import fcntl
+import json
+import shutil
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator
+
+from ann.artifacts import SOURCE_KEYS, PathLike, convert_to_npy
+
+
+@contextmanager
+def shared_dir_lock(shared_dir: PathLike) -> Iterator[None]:
+    """
+    Holds an exclusive lock on the shared directory, so that only one of the worker processes
+    starting at the same time prepares artifacts and the others wait and reuse them
+    """
+    Path(shared_dir).mkdir(parents=True, exist_ok=True)
+    with open(Path(shared_dir) / ".lock", "w") as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def _source_manifest(paths: Dict[str, Any], metric: str) -> Dict[str, Any]:
+    manifest: Dict[str, Any] = {"metric": metric}
+    for key in SOURCE_KEYS:
+        stat = Path(paths[key]).stat()
+        manifest[key] = {"path": str(Path(paths[key]).resolve()), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    return manifest
+
+
+def prepare_shared_artifacts(paths: Dict[str, Any], metric: str) -> Dict[str, Any]:
+    """
+    Converts vectors and mappings to .npy files in shared_dir/artifacts unless it already holds them
+    for the same sources. Must be called under shared_dir_lock.
+
+    Every worker memory-maps the returned files read-only, so the page cache keeps a single copy
+    of vectors, mappings, the Annoy index and prepared exact search vectors for all workers.
+    Putting shared_dir on tmpfs (e.g. /dev/shm) keeps this copy in shared memory.
+
+    Parameters
+    ----------
+    paths
+        The paths config, shared_dir key holds the directory for shared artifacts
+    metric
+        Annoy metric, prepared exact search vectors depend on it
+
+    Returns
+    -------
+    The paths config pointing to shared artifacts, with an extra exact_search_path key
+    """
+    artifacts_dir = Path(paths["shared_dir"]) / "artifacts"
+    manifest_path = artifacts_dir / "manifest.json"
+    manifest = _source_manifest(paths, metric)
+    stored_manifest = None
+    if manifest_path.exists():
+        with open(manifest_path, "r") as fh:
+            stored_manifest = json.load(fh)
+
+    if stored_manifest is not None and stored_manifest["manifest"] == manifest:
+        shared_paths = {key: Path(path) for key, path in stored_manifest["paths"].items()}
+    else:
+        shutil.rmtree(artifacts_dir, ignore_errors=True)
+        artifacts_dir.mkdir(parents=True)
+        shared_paths = convert_to_npy(output_dir=artifacts_dir, **{key: paths[key] for key in SOURCE_KEYS})
+        with open(manifest_path, "w") as fh:
+            json.dump({"manifest": manifest, "paths": {key: str(path) for key, path in shared_paths.items()}}, fh)
+
+    return {
+        **paths,
+        **shared_paths,
+        "index_path": artifacts_dir / Path(paths["index_path"]).name,
+        "exact_search_path": artifacts_dir / "item_vectors.prepared.npy",
+    }
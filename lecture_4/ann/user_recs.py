@@ -0,0 +1,173 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from typing import TYPE_CHECKING, AbstractSet, List, Optional
+
+import numpy as np
+from numpy.typing import NDArray
+
+from ann.artifacts import PathLike, save_json_atomic, save_npy_atomic
+
+if TYPE_CHECKING:
+    from ann.recommender import AnnoyRecommender
+
+
+class UserRecsTable:
+    """
+    Precomputed top-n recommendations of every user and a popularity ranking for cold users,
+    stored as memory-mapped .npy arrays
+
+    Attributes
+    ----------
+    ids
+        Array of shape (n_users, n) of recommended internal item ids indexed by internal user id,
+        -1 pads missing recommendations
+    popular
+        Internal ids of all items sorted by the number of users they are recommended to
+    popular_ranks
+        Position of every item in popular
+    """
+    def __init__(self, ids: NDArray[np.int32], popular: NDArray[np.int32]) -> None:
+        self.ids = ids
+        self.popular = popular
+        self.popular_ranks = np.empty(len(popular), dtype=np.int32)
+        self.popular_ranks[popular] = np.arange(len(popular), dtype=np.int32)
+
+    @property
+    def n(self) -> int:
+        return self.ids.shape[1]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def lookup(self, internal_uid: int, allowed_items: Optional[AbstractSet[int]], top_k: int) -> Optional[List[int]]:
+        """
+        Returns top_k precomputed recommendations that pass the whitelist, or None if fewer than
+        min(top_k, len(allowed_items)) of them pass it and the user has to be served by a live search
+        """
+        row = self.ids[internal_uid]
+        return _filter_top(row[row >= 0].tolist(), allowed_items, top_k)
+
+    def popular_top(self, allowed_items: Optional[NDArray[np.int64]], top_k: int) -> List[int]:
+        """
+        Returns top_k most popular items that are in the array of allowed items
+        """
+        if allowed_items is None:
+            return self.popular[:top_k].tolist()
+        if len(allowed_items) * 16 <= len(self.popular):
+            # a small whitelist is cheaper to rank directly than to find in a long prefix of popular items
+            ranks = self.popular_ranks[allowed_items]
+            if len(ranks) > top_k:
+                ranks = np.partition(ranks, top_k - 1)[:top_k]
+            return self.popular[np.sort(ranks)].tolist()
+        # popular items are checked in growing prefixes, so a whitelist of popular items stops early
+        prefix = 4 * top_k
+        while True:
+            candidates = self.popular[:prefix]
+            top = candidates[np.isin(candidates, allowed_items)][:top_k]
+            if len(top) == top_k or prefix >= len(self.popular):
+                return top.tolist()
+            prefix *= 4
+
+
+def _filter_top(candidates: List[int], allowed_items: Optional[AbstractSet[int]], top_k: int) -> Optional[List[int]]:
+    if allowed_items is None:
+        top = candidates[:top_k]
+        expected = top_k
+    else:
+        top = []
+        for item in candidates:
+            if item in allowed_items:
+                top.append(item)
+                if len(top) == top_k:
+                    break
+        expected = min(top_k, len(allowed_items))
+    return top if len(top) >= expected else None
+
+
+def _popular_path(path: PathLike) -> Path:
+    return Path(path).with_name(f"{Path(path).stem}.popular.npy")
+
+
+def _meta_path(path: PathLike) -> Path:
+    return Path(f"{path}.json")
+
+
+def load_user_recs_table(path: PathLike, fingerprint: str, n_users: int) -> Optional[UserRecsTable]:
+    """
+    Memory-maps a user recommendations table if it was built from the same vectors and mappings files and config
+
+    Parameters
+    ----------
+    path
+        Path of the .npy file with recommendations
+    fingerprint
+        Fingerprint of the vectors and mappings files and the config, see ann.factory.user_recs_fingerprint
+    n_users
+        Number of user vectors
+
+    Returns
+    -------
+    Loaded table or None if there is no table or it is stale
+    """
+    if not Path(path).exists() or not _meta_path(path).exists():
+        return None
+    with open(_meta_path(path), "r") as fh:
+        meta = json.load(fh)
+    ids = np.load(path, mmap_mode="r", allow_pickle=False)
+    if len(ids) != n_users or meta.get("sources_fingerprint") != fingerprint:
+        return None
+    return UserRecsTable(ids, np.load(_popular_path(path), mmap_mode="r", allow_pickle=False))
+
+
+def build_user_recs_table(
+    path: PathLike,
+    recommender: AnnoyRecommender,
+    n: int,
+    fingerprint: str,
+    bruteforce: bool = False,
+    chunk_size: int = 65536,
+) -> UserRecsTable:
+    """
+    Computes top-n recommendations of every user in user_vectors chunk by chunk, writing them
+    straight to a memory-mapped file, and ranks items by the number of users they are recommended to
+
+    Parameters
+    ----------
+    path
+        Path of the .npy file with recommendations
+    recommender
+        Fitted recommender, see AnnoyRecommender.recommend_internal_top_n
+    n
+        Number of recommendations per user, should be well above top_k to survive whitelist filtering
+    fingerprint
+        Fingerprint of the files and the config the recommender was created from, see ann.factory.user_recs_fingerprint
+    bruteforce
+        If True, users are scored exactly, otherwise the Annoy index is queried
+    chunk_size
+        Number of users processed at once
+    """
+    n_users, n_items = len(recommender.user_vectors), len(recommender.item_vectors)
+    n = min(n, n_items)
+    path = Path(path)
+    tmp_path = path.with_name(f"{path.stem}.tmp.npy")
+    ids = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.int32, shape=(n_users, n))
+    counts = np.zeros(n_items, dtype=np.int64)
+    for start in range(0, n_users, chunk_size):
+        internal_uids = np.arange(start, min(start + chunk_size, n_users))
+        chunk = recommender.recommend_internal_top_n(internal_uids, n, bruteforce=bruteforce)
+        ids[start:start + len(chunk)] = chunk
+        counts += np.bincount(chunk[chunk >= 0], minlength=n_items)
+    ids.flush()
+    del ids
+
+    popular = np.argsort(-counts, kind="stable").astype(np.int32)
+    save_npy_atomic(_popular_path(path), popular)
+    tmp_path.replace(path)
+    save_json_atomic(_meta_path(path), {
+        "n": n,
+        "bruteforce": bruteforce,
+        "sources_fingerprint": fingerprint,
+    })
+    return UserRecsTable(np.load(path, mmap_mode="r", allow_pickle=False), popular)
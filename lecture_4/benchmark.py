@@ -0,0 +1,352 @@
+"""
+Benchmark and parameter sweep of AnnoyRecommender
+
+Builds an index for every n_trees value and, for every combination of search_k, n_neighbors
+and whitelist selectivity, measures single query latency (p50/p99) and QPS, batch QPS and
+recall@top_k against exact scoring. Prints a table with Pareto optimal settings
+(no other setting with the same selectivity has both higher recall and higher QPS),
+compares memory and recall of float32 and int8 quantized exact search stores
+and writes a json report.
+
+Usage:
+    python benchmark.py --n-items 100000 --n-users 10000 --n-trees 10 50 --search-k -1 10000 --output report.json
+    python benchmark.py --shipped  # item vectors from the paths config, synthetic users
+    python benchmark.py --http http://localhost:80 --concurrency 16 --duration 30
+"""
+import argparse
+import json
+import platform
+import resource
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from itertools import product
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from ann.artifacts import load_vectors
+from ann.exact import ExactSearch
+from ann.factory import cosine_similarity
+from ann.mappings import IdMapping
+from ann.quantization import QuantizedExactSearch
+from ann.recommender import AnnoyRecommender
+from config.config import path_conf, recommender_conf
+
+
+def synthetic_vectors(n_users: int, n_items: int, dim: int, n_clusters: int = 64, seed: int = 0):
+    """
+    Generates clustered user and item embeddings, so that neighborhoods are not uniform as in real catalogs
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(n_clusters, dim)).astype(np.float32)
+    item_vectors = centers[rng.integers(n_clusters, size=n_items)] + 0.5 * rng.normal(size=(n_items, dim))
+    user_vectors = centers[rng.integers(n_clusters, size=n_users)] + 0.5 * rng.normal(size=(n_users, dim))
+    return user_vectors.astype(np.float32), item_vectors.astype(np.float32)
+
+
+def shipped_vectors(n_users: int, seed: int = 0):
+    """
+    Loads item vectors from the paths config, users are noisy copies of random items
+    unless user vectors are shipped as well
+    """
+    item_vectors = np.asarray(load_vectors(path_conf["item_vectors_path"]), dtype=np.float32)
+    if Path(path_conf["user_vectors_path"]).exists():
+        return np.asarray(load_vectors(path_conf["user_vectors_path"]), dtype=np.float32), item_vectors
+    rng = np.random.default_rng(seed)
+    base = item_vectors[rng.integers(len(item_vectors), size=n_users)]
+    noise = rng.normal(scale=base.std(), size=base.shape)
+    return (base + 0.5 * noise).astype(np.float32), item_vectors
+
+
+def percentiles_ms(latencies: Sequence[float]) -> Dict[str, float]:
+    latencies_ms = 1000 * np.asarray(latencies)
+    return {"p50_ms": float(np.percentile(latencies_ms, 50)), "p99_ms": float(np.percentile(latencies_ms, 99))}
+
+
+def recall_at_k(found: Sequence[Sequence[int]], expected: Sequence[Sequence[int]]) -> float:
+    recalls = [len(set(f) & set(e)) / len(e) for f, e in zip(found, expected) if len(e)]
+    return float(np.mean(recalls)) if recalls else 1.0
+
+
+def pareto_front(rows: List[Dict[str, Any]], x: str = "recall", y: str = "single_qps") -> List[Dict[str, Any]]:
+    """
+    Marks rows no other row of the same selectivity dominates in both x and y
+    """
+    for row in rows:
+        row["pareto"] = not any(
+            other["selectivity"] == row["selectivity"]
+            and other[x] >= row[x] and other[y] >= row[y]
+            and (other[x] > row[x] or other[y] > row[y])
+            for other in rows
+        )
+    return [row for row in rows if row["pareto"]]
+
+
+def benchmark_setting(
+    recommender: AnnoyRecommender,
+    query_users: np.ndarray,
+    whitelist: List[int],
+    expected: Sequence[Sequence[int]],
+) -> Dict[str, Any]:
+    latencies, found = [], []
+    for user_id in query_users.tolist():
+        start = time.perf_counter()
+        found.append(recommender.recommend_single_user(user_id, whitelist))
+        latencies.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    recommender.recommend_batch(query_users.tolist(), whitelist)
+    batch_seconds = time.perf_counter() - start
+    return {
+        "recall": recall_at_k(found, expected),
+        "single_qps": len(latencies) / sum(latencies),
+        "batch_qps": len(query_users) / batch_seconds,
+        **percentiles_ms(latencies),
+    }
+
+
+def benchmark_exact_stores(
+    item_vectors: np.ndarray,
+    user_vectors: np.ndarray,
+    query_users: np.ndarray,
+    whitelists: Dict[float, List[int]],
+    ground_truth: Dict[float, List[List[int]]],
+    args: argparse.Namespace,
+) -> List[Dict[str, Any]]:
+    """
+    Compares memory, batch QPS and recall of the float32 exact search against int8 quantized stores
+    with every rerank factor, rerank_factor 1 shows the recall cost of quantization alone
+    """
+    stores = [("float32", ExactSearch(item_vectors, args.metric))] + [
+        (f"int8 x{factor}", QuantizedExactSearch(item_vectors, args.metric, rerank_factor=factor))
+        for factor in args.rerank_factor
+    ]
+    rows = []
+    for name, store in stores:
+        store.fit()
+        store_bytes = store.nbytes if isinstance(store, QuantizedExactSearch) else store.prepared_vectors.nbytes
+        for selectivity, whitelist in whitelists.items():
+            allowed = None if not whitelist else np.asarray(whitelist, dtype=np.int64)
+            start = time.perf_counter()
+            found = store.search(user_vectors[query_users], args.top_k, allowed_items=allowed).tolist()
+            seconds = time.perf_counter() - start
+            rows.append({
+                "store": name,
+                "selectivity": selectivity,
+                "store_mb": store_bytes / 2 ** 20,
+                "recall": recall_at_k(found, ground_truth[selectivity]),
+                "batch_qps": len(query_users) / seconds,
+            })
+    return rows
+
+
+def run_sweep(args: argparse.Namespace) -> Dict[str, Any]:
+    if args.shipped:
+        user_vectors, item_vectors = shipped_vectors(args.n_users, args.seed)
+    else:
+        user_vectors, item_vectors = synthetic_vectors(args.n_users, args.n_items, args.dim, seed=args.seed)
+    n_users, n_items, dim = len(user_vectors), len(item_vectors), item_vectors.shape[1]
+    rng = np.random.default_rng(args.seed)
+    query_users = rng.choice(n_users, size=min(args.n_queries, n_users), replace=False)
+    whitelists = {
+        selectivity: [] if selectivity >= 1 else np.sort(
+            rng.choice(n_items, size=max(1, int(selectivity * n_items)), replace=False)
+        ).tolist()
+        for selectivity in args.selectivity
+    }
+
+    print(" ".join(f"{column:>11}" for column in COLUMNS))
+    rows, builds = [], []
+    ground_truth: Dict[float, List[List[int]]] = {}
+    for n_trees in args.n_trees:
+        recommender = AnnoyRecommender(
+            item_vectors=item_vectors,
+            user_vectors=user_vectors,
+            user_id_user_index_id_mapping=IdMapping(np.arange(n_users)),
+            item_id_item_index_id_mapping=IdMapping(np.arange(n_items)),
+            top_k=args.top_k,
+            dim=dim,
+            sim_function=cosine_similarity,
+            metric=args.metric,
+            n_trees=n_trees,
+            n_jobs=recommender_conf["n_jobs"],
+            adaptive_retrieval=args.adaptive_retrieval,
+        )
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            index_path = Path(tmp_dir) / "index.ann"
+            recommender.fit(index_path=index_path, index_signature={"n_trees": n_trees})
+            index_bytes = index_path.stat().st_size
+        builds.append({
+            "n_trees": n_trees,
+            "build_seconds": recommender.fit_seconds["index_build"],
+            "index_mb": index_bytes / 2 ** 20,
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        })
+
+        for selectivity, whitelist in whitelists.items():
+            if selectivity not in ground_truth:
+                allowed = None if not whitelist else np.asarray(whitelist, dtype=np.int64)
+                ground_truth[selectivity] = recommender.exact_search.search(
+                    user_vectors[query_users], args.top_k, allowed_items=allowed
+                ).tolist()
+            for search_k, n_neighbors in product(args.search_k, args.n_neighbors):
+                recommender.search_k, recommender.n_neighbors = search_k, n_neighbors
+                rows.append({
+                    "n_trees": n_trees,
+                    "search_k": search_k,
+                    "n_neighbors": n_neighbors,
+                    "selectivity": selectivity,
+                    **benchmark_setting(recommender, query_users, whitelist, ground_truth[selectivity]),
+                })
+                print_row(rows[-1])
+        recommender.close()
+
+    exact_stores = benchmark_exact_stores(item_vectors, user_vectors, query_users, whitelists, ground_truth, args)
+    return {
+        "setup": {
+            "n_users": n_users,
+            "n_items": n_items,
+            "dim": dim,
+            "metric": args.metric,
+            "top_k": args.top_k,
+            "n_queries": len(query_users),
+            "adaptive_retrieval": args.adaptive_retrieval,
+            "data": "shipped" if args.shipped else "synthetic",
+            "seed": args.seed,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+        },
+        "builds": builds,
+        "results": rows,
+        "pareto": pareto_front(rows),
+        "exact_stores": exact_stores,
+    }
+
+
+COLUMNS = ("n_trees", "search_k", "n_neighbors", "selectivity", "recall", "single_qps", "batch_qps", "p50_ms", "p99_ms")
+
+EXACT_STORE_COLUMNS = ("store", "selectivity", "store_mb", "recall", "batch_qps")
+
+
+def print_row(row: Dict[str, Any], marker: str = "") -> None:
+    cells = [f"{row[column]:>11.4g}" if isinstance(row[column], float) else f"{row[column]:>11}" for column in COLUMNS]
+    print(" ".join(cells), marker)
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print("\nIndex builds")
+    for build in report["builds"]:
+        print("  " + ", ".join(f"{key}={value:.4g}" for key, value in build.items()))
+    print("\n" + " ".join(f"{column:>11}" for column in COLUMNS))
+    for row in sorted(report["results"], key=lambda row: (row["selectivity"], -row["recall"])):
+        print_row(row, "*" if row["pareto"] else "")
+    print("* Pareto optimal in recall and single query QPS for its selectivity")
+    print("\nExact search stores")
+    print(" ".join(f"{column:>11}" for column in EXACT_STORE_COLUMNS))
+    for row in report["exact_stores"]:
+        print(" ".join(
+            f"{row[column]:>11.4g}" if isinstance(row[column], float) else f"{row[column]:>11}"
+            for column in EXACT_STORE_COLUMNS
+        ))
+
+
+def http_load_test(
+    url: str, user_ids: Sequence[int], whitelist: List[int], concurrency: int, duration: float,
+    endpoint: str = "/api/v1/recommend_for_user",
+) -> Dict[str, Any]:
+    """
+    Sends requests for random users from concurrency threads for duration seconds
+    """
+    deadline = time.perf_counter() + duration
+    rng = np.random.default_rng(0)
+
+    def _worker(seed: int) -> Dict[str, Any]:
+        worker_rng = np.random.default_rng(seed)
+        latencies, statuses, versions = [], {}, set()
+        while time.perf_counter() < deadline:
+            body = json.dumps({"user_id": int(worker_rng.choice(user_ids)), "item_whitelist": whitelist}).encode()
+            request = urllib.request.Request(url + endpoint, data=body, headers={"Content-Type": "application/json"})
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request) as response:
+                    response.read()
+                    status = response.status
+                    versions.add(response.headers.get("X-Model-Version"))
+            except urllib.error.HTTPError as exc:
+                status = exc.code
+            except urllib.error.URLError:
+                status = "connection_error"
+            latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+        return {"latencies": latencies, "statuses": statuses, "versions": versions}
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(_worker, rng.integers(2 ** 31, size=concurrency).tolist()))
+    elapsed = time.perf_counter() - started
+
+    latencies = [latency for result in results for latency in result["latencies"]]
+    statuses: Dict[str, int] = {}
+    for result in results:
+        for status, count in result["statuses"].items():
+            statuses[str(status)] = statuses.get(str(status), 0) + count
+    return {
+        "url": url + endpoint,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "qps": len(latencies) / elapsed,
+        "statuses": statuses,
+        "model_versions": sorted({version for result in results for version in result["versions"] if version}),
+        **(percentiles_ms(latencies) if latencies else {}),
+    }
+
+
+def parse_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shipped", action="store_true", help="use item vectors from the paths config")
+    parser.add_argument("--n-users", type=int, default=10000)
+    parser.add_argument("--n-items", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=recommender_conf["dim"])
+    parser.add_argument("--metric", default=recommender_conf["metric"])
+    parser.add_argument("--top-k", type=int, default=recommender_conf["top_k"])
+    parser.add_argument("--n-queries", type=int, default=1000, help="number of users queried per setting")
+    parser.add_argument("--n-trees", type=int, nargs="+", default=[10, recommender_conf["n_trees"]])
+    parser.add_argument("--search-k", type=int, nargs="+", default=[-1])
+    parser.add_argument("--n-neighbors", type=int, nargs="+", default=[recommender_conf["n_neighbors"]])
+    parser.add_argument(
+        "--selectivity", type=float, nargs="+", default=[1.0, 0.1, 0.01],
+        help="share of the catalog in the whitelist, 1 means no whitelist",
+    )
+    parser.add_argument("--adaptive-retrieval", action="store_true", default=recommender_conf["adaptive_retrieval"])
+    parser.add_argument("--no-adaptive-retrieval", dest="adaptive_retrieval", action="store_false")
+    parser.add_argument(
+        "--rerank-factor", type=int, nargs="+", default=[1, recommender_conf["rerank_factor"]],
+        help="rerank factors of int8 quantized exact search stores to compare with float32 vectors",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, default=Path("benchmark_report.json"))
+    parser.add_argument("--http", metavar="URL", help="load test a running service instead of sweeping parameters")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--http-users", type=int, default=1000, help="user ids 0..http_users-1 are requested")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    args = parse_args(argv)
+    if args.http:
+        report = http_load_test(args.http.rstrip("/"), list(range(args.http_users)), [], args.concurrency, args.duration)
+        print(json.dumps(report, indent=2))
+    else:
+        report = run_sweep(args)
+        print_report(report)
+    with open(args.output, "w") as fh:
+        json.dump(report, fh, indent=2)
+    print(f"Report saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
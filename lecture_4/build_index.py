@@ -0,0 +1,41 @@
+"""
+Offline step that builds the Annoy index and saves it next to the vectors
+(or into shared_dir together with the other shared artifacts, if it is configured),
+so that the service only memory-maps it at startup
+
+Usage: python build_index.py [--force]
+"""
+import argparse
+
+from ann.artifacts import load_index, load_vectors, save_index
+from ann.factory import artifact_paths, recommender_index_signature
+from ann.recommender import build_annoy_index
+from config.config import recommender_conf, path_conf
+
+
+def main(force: bool = False) -> None:
+    with artifact_paths(path_conf, recommender_conf["metric"]) as paths:
+        build(paths, force)
+
+
+def build(paths, force: bool = False) -> None:
+    signature = recommender_index_signature(paths, recommender_conf)
+    index_path = paths["index_path"]
+    if not force and load_index(index_path, recommender_conf["dim"], recommender_conf["metric"], signature) is not None:
+        print(f"Index {index_path} is up to date")
+        return
+    index = build_annoy_index(
+        load_vectors(paths["item_vectors_path"]),
+        recommender_conf["dim"],
+        recommender_conf["metric"],
+        recommender_conf["n_trees"],
+        recommender_conf["n_jobs"],
+    )
+    save_index(index, index_path, signature)
+    print(f"Index saved to {index_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--force", action="store_true", help="rebuild even if the saved index is up to date")
+    main(parser.parse_args().force)
@@ -0,0 +1,47 @@
+"""
+Offline step that precomputes top-k neighbors of every item for the similar items endpoint
+and saves them to neighbors_path as memory-mapped arrays. If items were only appended to
+the item vectors since the previous run, only the new items are processed
+
+Usage: python build_neighbors.py [--k K] [--method exact|annoy] [--full]
+"""
+import argparse
+
+import numpy as np
+
+from ann.artifacts import load_vectors
+from ann.exact import ExactSearch
+from ann.factory import artifact_paths, cosine_similarity, load_or_build_index, neighbors_fingerprint
+from ann.neighbors import build_neighbor_table
+from config.config import neighbors_conf, recommender_conf, path_conf
+
+
+def main(k: int, method: str, full: bool = False) -> None:
+    item_vectors = np.asarray(load_vectors(path_conf["item_vectors_path"]), dtype=np.float32)
+    exact = ExactSearch(item_vectors, recommender_conf["metric"], sim_function=cosine_similarity).fit()
+    index = None
+    with artifact_paths(path_conf, recommender_conf["metric"]) as paths:
+        fingerprint = neighbors_fingerprint(paths, recommender_conf)
+        if method == "annoy":
+            index = load_or_build_index(paths, recommender_conf, item_vectors)
+    table, n_computed = build_neighbor_table(
+        path_conf["neighbors_path"],
+        exact,
+        k,
+        method=method,
+        index=index,
+        search_k=recommender_conf["search_k"],
+        n_jobs=recommender_conf["n_jobs"],
+        incremental=not full,
+        fingerprint=fingerprint,
+    )
+    print(f"Neighbors of {n_computed} of {len(table)} items computed, table saved to {path_conf['neighbors_path']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--k", type=int, default=neighbors_conf["k"], help="number of neighbors per item")
+    parser.add_argument("--method", choices=["exact", "annoy"], default=neighbors_conf["method"])
+    parser.add_argument("--full", action="store_true", help="recompute all items instead of refreshing new ones")
+    args = parser.parse_args()
+    main(args.k, args.method, args.full)
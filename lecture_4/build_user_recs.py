@@ -0,0 +1,37 @@
+"""
+Offline step that precomputes top-n recommendations of every user and a popularity ranking
+for cold users, and saves them to user_recs_path as memory-mapped arrays. The service serves
+users from the table and falls back to a live search when a whitelist filters out too many
+of the precomputed items. The table is ignored once vectors or mappings change, or the metric,
+n_trees, top_k or bruteforce settings differ from the ones the service runs with
+
+Usage: python build_user_recs.py [--n N] [--bruteforce]
+"""
+import argparse
+from time import perf_counter
+
+from ann.factory import artifact_paths, create_recommender, user_recs_fingerprint
+from ann.user_recs import build_user_recs_table
+from config.config import recommender_conf, path_conf, user_recs_conf
+
+
+def main(n: int, bruteforce: bool = False) -> None:
+    with artifact_paths(path_conf, recommender_conf["metric"]) as paths:
+        recommender = create_recommender(paths, recommender_conf)
+        fingerprint = user_recs_fingerprint(paths, recommender_conf, bruteforce)
+    start = perf_counter()
+    table = build_user_recs_table(path_conf["user_recs_path"], recommender, n, fingerprint, bruteforce=bruteforce)
+    print(
+        f"Top {table.n} items of {len(table)} users computed in {perf_counter() - start:.1f}s, "
+        f"table saved to {path_conf['user_recs_path']}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--n", type=int, default=user_recs_conf["n"], help="number of recommendations per user")
+    parser.add_argument(
+        "--bruteforce", action="store_true", default=user_recs_conf["bruteforce"], help="score users exactly"
+    )
+    args = parser.parse_args()
+    main(args.n, args.bruteforce)
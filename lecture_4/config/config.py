@@ -6,4 +6,10 @@ with open(config_path, "r") as f:
     config = yaml.safe_load(f)
 
 recommender_conf = config["recommender"]
+batching_conf = config["batching"]
+cache_conf = config["cache"]
+reload_conf = config["reload"]
+metrics_conf = config["metrics"]
+neighbors_conf = config["neighbors"]
+user_recs_conf = config["user_recs"]
 path_conf = config["paths"]
\ No newline at end of file
@@ -0,0 +1,14 @@
+"""
+Converts pickled vectors and mappings from the paths config to .npy files,
+which the service memory-maps instead of unpickling. Point the paths config to
+the printed files afterwards.
+
+Usage: python convert_artifacts.py
+"""
+from ann.artifacts import convert_to_npy
+from config.config import path_conf
+
+
+if __name__ == "__main__":
+    for key, path in convert_to_npy(**path_conf).items():
+        print(f"{key}: {path}")
@@ -1,28 +1,20 @@
-import pickle
+from time import perf_counter
 from typing import List
 
 from fastapi import FastAPI, HTTPException
+from fastapi import Response as HttpResponse
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
-from scipy.spatial.distance import cdist
+from starlette.routing import Match
 
-from ann.recommender import AnnoyRecommender
-from config.config import recommender_conf, path_conf
-
-def load_object(path):
-    with open(path, "rb") as fh:
-        obj = pickle.load(fh)
-    return obj
-
-
-def read_vectors_and_mappings(
-    user_vectors_path, item_vectors_path, user_map_path, item_map_path
-):
-    return (
-        load_object(user_vectors_path),
-        load_object(item_vectors_path),
-        load_object(user_map_path),
-        load_object(item_map_path),
-    )
+from ann.artifacts import model_version
+from ann.cache import RecommendationCache
+from ann.factory import artifact_paths, create_recommender
+from ann.metrics import MetricsRegistry, instrument_recommender
+from ann.serving import HotReloader, ServingModel
+from config.config import (
+    batching_conf, cache_conf, metrics_conf, recommender_conf, reload_conf, path_conf, user_recs_conf
+)
 
 
 class Response(BaseModel):
@@ -35,35 +27,196 @@ class Request(BaseModel):
     item_whitelist: List[int]
 
 
+class UserError(BaseModel):
+    user_id: int
+    detail: str
+
+
+class BatchResponse(BaseModel):
+    recommendations: List[Response]
+    errors: List[UserError]
+
+
+class BatchRequest(BaseModel):
+    user_ids: List[int]
+    item_whitelist: List[int]
+    bruteforce: bool = False
+
+
+class SimilarItemsRequest(BaseModel):
+    item_id: int
+    item_whitelist: List[int]
+
+
+class SimilarItemsResponse(BaseModel):
+    item_id: int
+    item_ids: List[int]
+
+
+class ReloadResponse(BaseModel):
+    reloaded: bool
+    version: str
+
+
+MODEL_VERSION_HEADER = "X-Model-Version"
+
 app = FastAPI(docs_url="/docs", redoc_url="/redoc")
 
+# with metrics disabled nothing is instrumented and no middleware is installed
+metrics = MetricsRegistry() if metrics_conf["enabled"] else None
+
+if metrics is not None:
+    cache_requests = metrics.counter("recsys_cache_requests_total", "Response cache lookups", ["result"])
+    cache_evictions = metrics.counter("recsys_cache_evictions_total", "Response cache evictions", ["reason"])
+    cache_entries = metrics.gauge("recsys_cache_entries", "Number of cached responses")
+
+    def collect_cache_stats():
+        if app.state.cache is None:
+            return
+        stats = app.state.cache.stats()
+        cache_requests.set(("hit",), stats["hits"])
+        cache_requests.set(("miss",), stats["misses"])
+        cache_evictions.set(("lru",), stats["evictions"])
+        cache_evictions.set(("ttl",), stats["expirations"])
+        cache_entries.set((), stats["size"])
+    metrics.add_collector(collect_cache_stats)
+
+    def route_path(scope):
+        # the router does not put the matched route into the scope in the pinned starlette,
+        # so it is matched again here to label metrics by the route template
+        for route in app.router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return getattr(route, "path", "unmatched")
+        return "unmatched"
+
+    @app.middleware("http")
+    async def observe_requests(request, call_next):
+        start = perf_counter()
+        response = await call_next(request)
+        path = route_path(request.scope)
+        metrics.request_seconds.observe(perf_counter() - start, (path,))
+        metrics.requests.inc((path, str(response.status_code)))
+        return response
+
+
+def source_version():
+    return model_version(path_conf, recommender_conf)
+
+
+def load_recommender():
+    version = source_version()
+    with artifact_paths(path_conf, recommender_conf["metric"]) as paths:
+        recommender = create_recommender(
+            paths, recommender_conf, version, user_recs_bruteforce=user_recs_conf["bruteforce"]
+        )
+    if metrics is not None:
+        instrument_recommender(recommender, metrics)
+    return recommender
+
+
+def invalidate_cache(model: ServingModel):
+    if app.state.cache is not None:
+        app.state.cache.invalidate(model.version)
+
 
 @app.on_event("startup")
 async def startup():
-    user_vectors, item_vectors, user_map, item_map = read_vectors_and_mappings(**path_conf)
-    app.state.recommender = AnnoyRecommender(
-        item_vectors=item_vectors,
-        user_vectors=user_vectors,
-        user_id_user_index_id_mapping=user_map,
-        item_id_item_index_id_mapping=item_map,
-        sim_function=lambda x, y: 1 - cdist(x, y, metric='cosine'),
-        **recommender_conf
+    app.state.cache = RecommendationCache(**cache_conf) if cache_conf["max_entries"] > 0 else None
+    app.state.models = HotReloader(
+        load_recommender, source_version, batching_conf, on_swap=invalidate_cache, **reload_conf
     )
-    app.state.recommender.fit()
+    await app.state.models.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await app.state.models.stop()
+
+
+async def recommend_cached(model: ServingModel, request: Request, bruteforce: bool = False):
+    """
+    Serves repeated requests of a user with the same whitelist from the response cache
+    """
+    cache = app.state.cache
+    if cache is None:
+        return await model.batcher.submit(request.user_id, request.item_whitelist, bruteforce=bruteforce)
+    key = cache.key(request.user_id, request.item_whitelist, bruteforce, model.version)
+    recommendations = cache.get(key)
+    if recommendations is None:
+        recommendations = await model.batcher.submit(request.user_id, request.item_whitelist, bruteforce=bruteforce)
+        cache.put(key, recommendations)
+    return list(recommendations)
+
 
 @app.post("/api/v1/recommend_for_user", response_model=Response)
-async def recommend_for_user(request: Request):
+async def recommend_for_user(request: Request, http_response: HttpResponse):
+    model = app.state.models.model
+    http_response.headers[MODEL_VERSION_HEADER] = model.version
     try:
-        recommendations = app.state.recommender.recommend_single_user(
-            request.user_id, request.item_whitelist
-        )
+        recommendations = await recommend_cached(model, request)
     except KeyError:
         raise HTTPException(status_code=404, detail="Item or user not found")
     return Response(user_id=request.user_id, item_ids=recommendations)
 
 @app.post("/api/v1/recommend_bruteforce", response_model=Response)
-async def recommend_bruteforce(request: Request):
-    recommendations = app.state.recommender.recommend_bruteforce_single_user(
-        request.user_id, request.item_whitelist
-    )
+async def recommend_bruteforce(request: Request, http_response: HttpResponse):
+    model = app.state.models.model
+    http_response.headers[MODEL_VERSION_HEADER] = model.version
+    try:
+        recommendations = await recommend_cached(model, request, bruteforce=True)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Item or user not found")
     return Response(user_id=request.user_id, item_ids=recommendations)
+
+@app.post("/api/v1/recommend_batch", response_model=BatchResponse)
+async def recommend_batch(request: BatchRequest, http_response: HttpResponse):
+    model = app.state.models.model
+    http_response.headers[MODEL_VERSION_HEADER] = model.version
+    try:
+        recommendations, errors = await model.batcher.run(
+            model.recommender.recommend_batch, request.user_ids, request.item_whitelist, request.bruteforce
+        )
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Item not found")
+    return BatchResponse(
+        recommendations=[
+            Response(user_id=user_id, item_ids=item_ids) for user_id, item_ids in recommendations.items()
+        ],
+        errors=[UserError(user_id=user_id, detail=detail) for user_id, detail in errors.items()],
+    )
+
+@app.post("/api/v1/similar_items", response_model=SimilarItemsResponse)
+async def similar_items(request: SimilarItemsRequest, http_response: HttpResponse):
+    model = app.state.models.model
+    http_response.headers[MODEL_VERSION_HEADER] = model.version
+    try:
+        item_ids = await model.batcher.run(
+            model.recommender.recommend_similar_items, request.item_id, request.item_whitelist
+        )
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Item not found")
+    return SimilarItemsResponse(item_id=request.item_id, item_ids=item_ids)
+
+@app.get("/api/v1/cache_stats")
+async def cache_stats():
+    if app.state.cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **app.state.cache.stats()}
+
+@app.post("/api/v1/admin/reload", response_model=ReloadResponse)
+async def reload(force: bool = False):
+    """
+    Loads artifacts from paths in the background and swaps the new model in if they changed (or force is set)
+    """
+    try:
+        reloaded = await app.state.models.reload(force=force)
+    except Exception as exc:  # pylint: disable=broad-except
+        raise HTTPException(status_code=500, detail=f"Reload failed, the active model is kept: {exc}")
+    return ReloadResponse(reloaded=reloaded, version=app.state.models.model.version)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    if metrics is None:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -1,5 +1,8 @@
+from concurrent.futures import ThreadPoolExecutor
+
 import pandas as pd
 import numpy as np
+import scipy.sparse as sp
 
 
 def generate_lightfm_recs_mapper(model, item_ids, known_items, 
@@ -23,6 +26,61 @@ def generate_lightfm_recs_mapper(model, item_ids, known_items,
     return _recs_mapper
 
 
+def get_known_items_matrix(df, user_mapping, item_mapping):
+    users = df['user_id'].map(user_mapping)
+    items = df['item_id'].map(item_mapping)
+    known = users.notnull() & items.notnull()
+    return sp.csr_matrix(
+        (np.ones(known.sum(), dtype=np.float32), 
+         (users[known].astype(np.int64), items[known].astype(np.int64))),
+        shape=(len(user_mapping), len(item_mapping)))
+
+
+def generate_lightfm_recs_batched(model, list_user_id, item_ids, known_items_matrix, 
+                                  user_features, item_features, N, 
+                                  user_mapping, item_inv_mapping, 
+                                  num_threads=1, chunk_size=4096):
+    """
+    Batched counterpart of generate_lightfm_recs_mapper: returns a list of recommended item ids
+    for every user in list_user_id, e.g. df['item_id'] = generate_lightfm_recs_batched(..., df['user_id'], ...).
+    User and item representations (features included) are computed once, chunks of users are scored
+    with one matrix product in num_threads threads and items of known_items_matrix
+    (CSR users x items in lightfm internal ids, e.g. from get_known_items_matrix) are masked before top N
+    """
+    user_biases, user_embeddings = model.get_user_representations(user_features)
+    item_biases, item_embeddings = model.get_item_representations(item_features)
+    item_ids = np.asarray(item_ids, dtype=np.int64)
+    item_positions = np.full(item_embeddings.shape[0], -1)
+    item_positions[item_ids] = np.arange(len(item_ids))
+    item_biases, item_embeddings = item_biases[item_ids], item_embeddings[item_ids]
+    external_item_ids = pd.Series(item_inv_mapping).reindex(item_ids).to_numpy()
+    internal_user_ids = pd.Series(list_user_id).map(user_mapping).to_numpy(dtype=np.int64)
+    if known_items_matrix is not None:
+        known_items_matrix = known_items_matrix.tocsr()
+    n = min(N, len(item_ids))
+
+    def _recommend_chunk(start):
+        users = internal_user_ids[start:start + chunk_size]
+        scores = user_embeddings[users] @ item_embeddings.T
+        scores += user_biases[users][:, None]
+        scores += item_biases[None, :]
+        if known_items_matrix is not None:
+            known = known_items_matrix[users]
+            rows = np.repeat(np.arange(len(users)), np.diff(known.indptr))
+            cols = item_positions[known.indices]
+            scores[rows[cols >= 0], cols[cols >= 0]] = -np.inf
+        top = np.argpartition(-scores, n - 1, axis=1)[:, :n]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind='stable')
+        top = np.take_along_axis(top, order, axis=1)
+        valid = np.isfinite(np.take_along_axis(top_scores, order, axis=1))
+        return [external_item_ids[row[mask]].tolist() for row, mask in zip(top, valid)]
+
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        chunks = executor.map(_recommend_chunk, range(0, len(internal_user_ids), chunk_size))
+        return [recs for chunk in chunks for recs in chunk]
+
+
 def compute_metrics(df_true, df_pred, top_N, rank_col='rank'):
     result = {}
     test_recs = df_true.set_index(['user_id', 'item_id']).join(df_pred.set_index(['user_id', 'item_id']))
@@ -43,3 +101,74 @@ def compute_metrics(df_true, df_pred, top_N, rank_col='rank'):
     result[f'MAP@{top_N}'] = (test_recs["cumulative_rank"] / test_recs["users_item_count"]).sum() / users_count
     result[f'MRR'] = test_recs.groupby(level='user_id')['reciprocal_rank'].max().mean()
     return pd.Series(result)
+
+
+def _encode_pairs(df_true, df_pred):
+    user_codes, _ = pd.factorize(pd.concat([df_true['user_id'], df_pred['user_id']], ignore_index=True))
+    item_codes, item_uniques = pd.factorize(pd.concat([df_true['item_id'], df_pred['item_id']], ignore_index=True))
+    pair_keys = user_codes.astype(np.int64) * max(len(item_uniques), 1) + item_codes
+    n_true = len(df_true)
+    return user_codes[:n_true], pair_keys[:n_true], pair_keys[n_true:]
+
+
+def _lookup_ranks(true_keys, pred_keys, pred_ranks):
+    order = np.argsort(pred_keys, kind='stable')
+    sorted_keys = pred_keys[order]
+    ranks = np.full(len(true_keys), np.nan)
+    if len(sorted_keys) == 0:
+        return ranks
+    positions = np.minimum(np.searchsorted(sorted_keys, true_keys), len(sorted_keys) - 1)
+    found = sorted_keys[positions] == true_keys
+    ranks[found] = pred_ranks[order][positions[found]]
+    return ranks
+
+
+def compute_metrics_fast(df_true, df_pred, top_N, rank_col='rank', ndcg=True):
+    """
+    Same metrics as compute_metrics (plus NDCG@k) in a single vectorized pass:
+    ids are encoded to integer codes once, ranks of test items are found with searchsorted
+    and metrics for all k come from cumulative sums over a per-user hit matrix.
+    (user_id, item_id) pairs in df_pred are expected to be unique
+    """
+    true_users, true_keys, pred_keys = _encode_pairs(df_true, df_pred)
+    ranks = _lookup_ranks(true_keys, pred_keys, df_pred[rank_col].to_numpy(dtype=np.float64))
+
+    _, users, users_item_count = np.unique(true_users, return_inverse=True, return_counts=True)
+    users_count = len(users_item_count)
+    item_count = users_item_count[users]
+    hit = ~np.isnan(ranks)
+    hit_users, hit_ranks, hit_item_count = users[hit], ranks[hit], item_count[hit]
+
+    order = np.lexsort((hit_ranks, hit_users))
+    hit_users, hit_ranks, hit_item_count = hit_users[order], hit_ranks[order], hit_item_count[order]
+    group_starts = np.r_[0, np.flatnonzero(np.diff(hit_users)) + 1]
+    group_sizes = np.diff(np.r_[group_starts, len(hit_users)])
+    cumulative_rank = np.arange(len(hit_users)) - np.repeat(group_starts, group_sizes) + 1
+
+    in_top = hit_ranks <= top_N
+    top_ranks = hit_ranks[in_top].astype(np.int64)
+    hits_at = np.cumsum(np.bincount(top_ranks, minlength=top_N + 1)[1:])
+    recall_at = np.cumsum(np.bincount(top_ranks, weights=1 / hit_item_count[in_top], minlength=top_N + 1)[1:])
+
+    result = {}
+    for k in range(1, top_N + 1):
+        result[f'Precision@{k}'] = hits_at[k - 1] / k / users_count
+        result[f'Recall@{k}'] = recall_at[k - 1] / users_count
+
+    result[f'MAP@{top_N}'] = (cumulative_rank / hit_ranks / hit_item_count).sum() / users_count
+    reciprocal_rank = np.zeros(users_count)
+    np.maximum.at(reciprocal_rank, hit_users, 1 / hit_ranks)
+    result['MRR'] = reciprocal_rank.mean()
+
+    if ndcg:
+        discounts = 1 / np.log2(np.arange(2, top_N + 2))
+        ideal_dcg = np.r_[0, np.cumsum(discounts)]
+        dcg_users, dcg_codes = np.unique(hit_users[in_top], return_inverse=True)
+        dcg = np.zeros((len(dcg_users), top_N))
+        np.add.at(dcg, (dcg_codes, top_ranks - 1), discounts[top_ranks - 1])
+        dcg = np.cumsum(dcg, axis=1)
+        ideal = ideal_dcg[np.minimum(users_item_count[dcg_users][:, None], np.arange(1, top_N + 1))]
+        ndcg_at = (dcg / ideal).sum(axis=0) / users_count
+        for k in range(1, top_N + 1):
+            result[f'NDCG@{k}'] = ndcg_at[k - 1]
+    return pd.Series(result)